@@ -1,22 +1,29 @@
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
-                             QPushButton, QTableWidget, QTableWidgetItem, 
+                             QPushButton, QTableView, QLineEdit, QComboBox,
                              QMessageBox, QHeaderView, QTabWidget)
-from PyQt5.QtCore import QTimer, Qt
-from PyQt5.QtGui import QFont, QColor
-from database import get_all_users, delete_user, get_recent_logs
+from PyQt5.QtCore import pyqtSignal
+from database import delete_user, get_occupancy
+from table_models import UsersTableModel, AccessLogTableModel, PresenceTableModel
+from log_watcher import AccessLogWatcher
 
 
 class AdminPanel(QWidget):
     """Панель администратора для просмотра баз данных"""
     
+    # Сигнал об изменении базы пользователей (например, после удаления)
+    users_changed = pyqtSignal()
+    
     def __init__(self):
         super().__init__()
+        self.logs_stale = False
+        self.presence_stale = False
         self.init_ui()
         
-        # Таймер для автообновления логов каждые 5 секунд
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.refresh_logs)
-        self.timer.start(5000)
+        # Журнал обновляется по уведомлениям о новых событиях и только
+        # пока панель видна (см. showEvent/hideEvent)
+        self.log_watcher = AccessLogWatcher(parent=self)
+        self.log_watcher.changed.connect(self.refresh_logs)
+        self.log_watcher.changed.connect(self.refresh_presence)
     
     def init_ui(self):
         """Инициализация интерфейса"""
@@ -28,6 +35,7 @@ class AdminPanel(QWidget):
         
         # Создаем вкладки
         tabs = QTabWidget()
+        self.tabs = tabs
         tabs.setStyleSheet("""
             QTabWidget::pane {
                 border: 1px solid #e0e0e0;
@@ -54,13 +62,16 @@ class AdminPanel(QWidget):
         """)
         tabs.addTab(self.create_users_tab(), "📋 База пользователей")
         tabs.addTab(self.create_logs_tab(), "🕐 Журнал доступа")
+        tabs.addTab(self.create_presence_tab(), "🏢 Сейчас в здании")
         
+        tabs.currentChanged.connect(self.on_tab_changed)
         layout.addWidget(tabs)
         self.setLayout(layout)
         
         # Загружаем данные
         self.load_users()
         self.load_logs()
+        self.load_presence()
     
     def create_users_tab(self):
         """Создание вкладки с полной базой пользователей"""
@@ -79,6 +90,13 @@ class AdminPanel(QWidget):
         
         top_layout.addStretch()
         
+        # Поиск выполняется в базе, а не по загруженным строкам
+        self.users_search = QLineEdit()
+        self.users_search.setPlaceholderText("🔍 ID, имя, фамилия или факультет")
+        self.users_search.setStyleSheet(self.filter_style())
+        self.users_search.returnPressed.connect(self.apply_users_filter)
+        top_layout.addWidget(self.users_search)
+        
         refresh_btn = QPushButton("🔄 Обновить")
         refresh_btn.setStyleSheet("""
             QPushButton {
@@ -116,17 +134,16 @@ class AdminPanel(QWidget):
         
         layout.addLayout(top_layout)
         
-        # Таблица пользователей
-        self.users_table = QTableWidget()
-        self.users_table.setColumnCount(6)
-        self.users_table.setHorizontalHeaderLabels([
-            "ID", "ID Студента", "Имя", "Фамилия", "Факультет", "Дата регистрации"
-        ])
+        # Таблица пользователей (строки подгружаются по мере прокрутки)
+        self.users_model = UsersTableModel(self)
+        self.users_table = QTableView()
         self.users_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
-        self.users_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.users_table.verticalHeader().setVisible(False)
+        self.users_table.setSelectionBehavior(QTableView.SelectRows)
+        self.users_table.setSelectionMode(QTableView.SingleSelection)
         self.users_table.setAlternatingRowColors(True)
         self.users_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #e0e0e0;
                 border-radius: 6px;
                 background-color: white;
@@ -141,11 +158,11 @@ class AdminPanel(QWidget):
                 border: none;
                 border-bottom: 2px solid #e0e0e0;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
                 color: #212529;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #e7f3ff;
                 color: #1a1a1a;
             }
@@ -166,7 +183,7 @@ class AdminPanel(QWidget):
         # Информационная панель
         top_layout = QHBoxLayout()
         
-        info_label = QLabel("🔴 Live мониторинг • Обновление каждые 5 сек")
+        info_label = QLabel("🔴 Live мониторинг • Обновление при новых событиях")
         info_label.setStyleSheet("color: #dc3545; font-weight: 500; font-size: 13px;")
         top_layout.addWidget(info_label)
         
@@ -187,20 +204,32 @@ class AdminPanel(QWidget):
             }
         """)
         refresh_btn.clicked.connect(self.load_logs)
+        
+        # Фильтры журнала (выполняются в SQL)
+        self.logs_student_filter = QLineEdit()
+        self.logs_student_filter.setPlaceholderText("ID студента")
+        self.logs_student_filter.setStyleSheet(self.filter_style())
+        self.logs_student_filter.returnPressed.connect(self.apply_logs_filter)
+        
+        self.logs_action_filter = QComboBox()
+        self.logs_action_filter.addItems(["Все действия", "Вход", "Выход"])
+        self.logs_action_filter.setStyleSheet(self.filter_style())
+        self.logs_action_filter.currentIndexChanged.connect(self.apply_logs_filter)
+        
+        top_layout.addWidget(self.logs_student_filter)
+        top_layout.addWidget(self.logs_action_filter)
         top_layout.addWidget(refresh_btn)
         
         layout.addLayout(top_layout)
         
-        # Таблица логов
-        self.logs_table = QTableWidget()
-        self.logs_table.setColumnCount(6)
-        self.logs_table.setHorizontalHeaderLabels([
-            "ID", "ID Студента", "ФИО", "Действие", "Локация", "Время"
-        ])
+        # Таблица логов (новые события дописываются без перерисовки старых)
+        self.logs_model = AccessLogTableModel(self)
+        self.logs_table = QTableView()
         self.logs_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.logs_table.verticalHeader().setVisible(False)
         self.logs_table.setAlternatingRowColors(True)
         self.logs_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 border: 1px solid #e0e0e0;
                 border-radius: 6px;
                 background-color: white;
@@ -215,11 +244,11 @@ class AdminPanel(QWidget):
                 border: none;
                 border-bottom: 2px solid #e0e0e0;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 8px;
                 color: #212529;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #e7f3ff;
                 color: #1a1a1a;
             }
@@ -229,51 +258,147 @@ class AdminPanel(QWidget):
         tab.setLayout(layout)
         return tab
     
+    def create_presence_tab(self):
+        """Создание вкладки с теми, кто сейчас внутри (для переклички)"""
+        tab = QWidget()
+        tab.setStyleSheet("background-color: white;")
+        layout = QVBoxLayout()
+        layout.setContentsMargins(20, 20, 20, 20)
+        layout.setSpacing(15)
+        
+        # Сводка по локациям и кнопка обновления
+        top_layout = QHBoxLayout()
+        
+        self.occupancy_label = QLabel()
+        self.occupancy_label.setStyleSheet("font-size: 15px; font-weight: 500; color: #1a1a1a;")
+        top_layout.addWidget(self.occupancy_label)
+        
+        top_layout.addStretch()
+        
+        refresh_btn = QPushButton("🔄 Обновить")
+        refresh_btn.setStyleSheet("""
+            QPushButton {
+                background-color: #4A90E2;
+                color: white;
+                padding: 8px 16px;
+                border: none;
+                border-radius: 6px;
+                font-weight: 500;
+            }
+            QPushButton:hover {
+                background-color: #357ABD;
+            }
+        """)
+        refresh_btn.clicked.connect(self.load_presence)
+        top_layout.addWidget(refresh_btn)
+        
+        layout.addLayout(top_layout)
+        
+        # Список находящихся внутри (поддерживается триггером при каждом событии)
+        self.presence_model = PresenceTableModel(self)
+        self.presence_table = QTableView()
+        self.presence_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.presence_table.verticalHeader().setVisible(False)
+        self.presence_table.setAlternatingRowColors(True)
+        self.presence_table.setStyleSheet(self.logs_table.styleSheet())
+        
+        layout.addWidget(self.presence_table)
+        tab.setLayout(layout)
+        return tab
+    
+    @staticmethod
+    def filter_style():
+        """Стиль полей фильтра"""
+        return """
+            QLineEdit, QComboBox {
+                padding: 7px 10px;
+                border: 1px solid #e0e0e0;
+                border-radius: 6px;
+                background-color: white;
+                color: #212529;
+            }
+        """
+    
     def load_users(self):
         """Загрузка пользователей в таблицу"""
-        users = get_all_users()
-        self.users_table.setRowCount(len(users))
-        
-        for row, user in enumerate(users):
-            for col, value in enumerate(user):
-                item = QTableWidgetItem(str(value))
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                self.users_table.setItem(row, col, item)
+        if self.users_table.model() is None:
+            self.users_model.attach(self.users_table)
+        else:
+            self.users_model.reload()
+    
+    def apply_users_filter(self):
+        """Поиск пользователей по введенной строке"""
+        self.users_model.set_filters(search=self.users_search.text().strip())
     
     def load_logs(self):
         """Загрузка логов в таблицу"""
-        logs = get_recent_logs(100)
-        self.logs_table.setRowCount(len(logs))
-        
-        for row, log in enumerate(logs):
-            for col, value in enumerate(log):
-                item = QTableWidgetItem(str(value))
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
-                
-                # Цветовая маркировка действий
-                if col == 3:  # Колонка "Действие"
-                    if value == "Вход":
-                        item.setBackground(QColor(212, 237, 218))  # Светло-зеленый
-                        item.setForeground(QColor(21, 87, 36))
-                    elif value == "Выход":
-                        item.setBackground(QColor(255, 243, 205))  # Светло-желтый
-                        item.setForeground(QColor(133, 100, 4))
-                
-                self.logs_table.setItem(row, col, item)
+        if self.logs_table.model() is None:
+            self.logs_model.attach(self.logs_table)
+        else:
+            self.logs_model.reload()
+    
+    def apply_logs_filter(self):
+        """Фильтрация журнала по ID студента и действию"""
+        action = self.logs_action_filter.currentText()
+        self.logs_model.set_filters(
+            student_id=self.logs_student_filter.text().strip(),
+            action=action if self.logs_action_filter.currentIndex() > 0 else None)
     
     def refresh_logs(self):
-        """Автоматическое обновление логов"""
-        self.load_logs()
+        """Автоматическое обновление логов: дозагрузка только новых событий"""
+        # Скрытая вкладка журнала обновится, когда ее откроют
+        if not self.logs_table.isVisible():
+            self.logs_stale = True
+            return
+        self.logs_stale = False
+        self.logs_model.fetch_new()
+    
+    def load_presence(self):
+        """Загрузка сводки и списка находящихся внутри"""
+        occupancy = get_occupancy()
+        parts = [f"Всего внутри: {sum(occupancy.values())}"]
+        parts += [f"{location}: {count}" for location, count in sorted(occupancy.items())]
+        self.occupancy_label.setText("👥 " + " • ".join(parts))
+        if self.presence_table.model() is None:
+            self.presence_model.attach(self.presence_table)
+        else:
+            self.presence_model.reload()
+    
+    def refresh_presence(self):
+        """Обновление списка находящихся внутри при новых событиях"""
+        if not self.presence_table.isVisible():
+            self.presence_stale = True
+            return
+        self.presence_stale = False
+        self.load_presence()
+    
+    def on_tab_changed(self, index):
+        """Догрузить события, пришедшие пока вкладка была скрыта"""
+        if self.logs_stale:
+            self.refresh_logs()
+        if self.presence_stale:
+            self.refresh_presence()
+    
+    def showEvent(self, event):
+        """Панель показана: догружаем пропущенное и подписываемся на изменения"""
+        super().showEvent(event)
+        self.log_watcher.start()
+        self.refresh_logs()
+        self.refresh_presence()
+    
+    def hideEvent(self, event):
+        """Панель скрыта: база журнала не опрашивается"""
+        self.log_watcher.stop()
+        super().hideEvent(event)
     
     def delete_user(self):
         """Удаление выбранного пользователя"""
-        selected = self.users_table.currentRow()
+        selected = self.users_table.currentIndex().row()
         if selected < 0:
             QMessageBox.warning(self, "Ошибка", "Выберите пользователя для удаления")
             return
         
-        user_id = int(self.users_table.item(selected, 0).text())
-        student_id = self.users_table.item(selected, 1).text()
+        user_id, student_id = self.users_model.rows[selected][:2]
         
         reply = QMessageBox.question(self, "Подтверждение", 
                                      f"Удалить пользователя {student_id}?",
@@ -281,11 +406,11 @@ class AdminPanel(QWidget):
         
         if reply == QMessageBox.Yes:
             delete_user(user_id)
+            self.users_changed.emit()
             QMessageBox.information(self, "Успех", "Пользователь удален")
             self.load_users()
     
     def closeEvent(self, event):
-        """Остановка таймера при закрытии"""
-        if hasattr(self, 'timer'):
-            self.timer.stop()
+        """Остановка наблюдения за журналом при закрытии"""
+        self.log_watcher.stop()
         super().closeEvent(event)
\ No newline at end of file
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import numpy as np
+
+from database import DB_USERS
+
+# Файл индекса хранится рядом с базой пользователей
+ANN_INDEX_PATH = os.path.splitext(DB_USERS)[0] + ".ivf.npz"
+
+# Галереи меньше этого размера быстрее перебирать целиком
+ANN_MIN_GALLERY_SIZE = 20000
+
+DEFAULT_NPROBE = 8
+ASSIGN_CHUNK = 8192
+
+
+def _sq_distances(data, centroids, centroid_sq_norms):
+    """Квадраты расстояний от строк data до всех центроидов"""
+    return (np.einsum('ij,ij->i', data, data)[:, None]
+            + centroid_sq_norms[None, :]
+            - 2.0 * data @ centroids.T)
+
+
+def assign_to_centroids(data, centroids):
+    """Номер ближайшего центроида для каждой строки (по блокам, чтобы не раздувать память)"""
+    centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), ASSIGN_CHUNK):
+        chunk = data[start:start + ASSIGN_CHUNK]
+        labels[start:start + ASSIGN_CHUNK] = np.argmin(
+            _sq_distances(chunk, centroids, centroid_sq_norms), axis=1)
+    return labels
+
+
+def kmeans(data, k, n_iter=20, sample_size=100000, seed=0):
+    """Обучение грубых центроидов k-means (алгоритм Ллойда) на подвыборке"""
+    rng = np.random.default_rng(seed)
+    if len(data) > sample_size:
+        data = data[rng.choice(len(data), sample_size, replace=False)]
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = assign_to_centroids(data, centroids)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # Суммы по кластерам одним проходом по отсортированным данным
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.add.reduceat(data[order], starts[~empty], axis=0)
+        centroids[~empty] = sums / counts[~empty, None]
+        # Пустые кластеры переинициализируем случайными точками
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def gallery_fingerprint(encodings, student_ids):
+    """Отпечаток содержимого галереи для проверки актуальности индекса"""
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(encodings, dtype=np.float32).tobytes())
+    h.update("\x00".join(map(str, student_ids)).encode())
+    return h.hexdigest()
+
+
+class IVFIndex:
+    """Приближенный поиск ближайших соседей (IVF) на чистом NumPy
+
+    Векторы галереи разбиваются на nlist кластеров k-means. При поиске
+    просматриваются только nprobe ближайших кластеров; nprobe задает
+    баланс между полнотой (recall) и скоростью. Индекс возвращает лишь
+    кандидатов — итоговое решение по порогу принимается по точным
+    расстояниям (см. FaceGallery.nearest).
+    """
+
+    def __init__(self, centroids, nprobe=DEFAULT_NPROBE):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.centroid_sq_norms = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        self.nprobe = nprobe
+        self.labels = np.empty(0, dtype=np.int32)
+        self.order = np.empty(0, dtype=np.int64)
+        self.offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        self.fingerprint = None
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def train(cls, encodings, nlist=None, nprobe=DEFAULT_NPROBE, n_iter=20, seed=0):
+        """Обучение индекса на векторах галереи"""
+        encodings = np.asarray(encodings, dtype=np.float32)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(len(encodings))))
+        nlist = min(nlist, len(encodings))
+        index = cls(kmeans(encodings, nlist, n_iter=n_iter, seed=seed), nprobe)
+        index.assign(encodings)
+        return index
+
+    def assign(self, encodings):
+        """Раскладка векторов галереи по спискам кластеров"""
+        self.labels = assign_to_centroids(np.asarray(encodings, dtype=np.float32), self.centroids)
+        self._build_lists()
+
+    def label(self, encodings):
+        """Номера кластеров для новых векторов"""
+        return assign_to_centroids(np.asarray(encodings, dtype=np.float32), self.centroids)
+
+    def set_labels(self, labels):
+        """Заменить раскладку после инкрементального изменения галереи"""
+        self.labels = np.asarray(labels, dtype=np.int32)
+        self._build_lists()
+        # Индекс больше не соответствует сохраненному на диске отпечатку
+        self.fingerprint = None
+
+    def _build_lists(self):
+        # Списки хранятся компактно: order отсортирован по кластеру,
+        # offsets[c]:offsets[c + 1] — диапазон кластера c
+        self.order = np.argsort(self.labels, kind='stable')
+        counts = np.bincount(self.labels, minlength=self.nlist)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def candidates(self, query, nprobe=None):
+        """Индексы строк галереи из nprobe ближайших к запросу кластеров"""
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        coarse = _sq_distances(query, self.centroids, self.centroid_sq_norms)[0]
+        if nprobe < self.nlist:
+            probes = np.argpartition(coarse, nprobe - 1)[:nprobe]
+        else:
+            probes = np.arange(self.nlist)
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in probes])
+
+    def save(self, path=ANN_INDEX_PATH):
+        """Сохранение индекса на диск"""
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, centroids=self.centroids, labels=self.labels,
+                 nprobe=self.nprobe, fingerprint=self.fingerprint or "")
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=ANN_INDEX_PATH):
+        """Загрузка индекса с диска"""
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(data['centroids'], int(data['nprobe']))
+            index.labels = data['labels'].astype(np.int32)
+            index.fingerprint = str(data['fingerprint']) or None
+        index._build_lists()
+        return index
+
+
+def load_or_build_index(encodings, student_ids, path=ANN_INDEX_PATH, nlist=None,
+                        nprobe=None, fingerprint=None):
+    """Загрузить индекс с диска или построить заново
+
+    Если галерея изменилась, сохраненные центроиды переиспользуются и
+    векторы просто перераскладываются по кластерам без переобучения.
+    fingerprint по умолчанию вычисляется хешированием всей галереи.
+    """
+    if fingerprint is None:
+        fingerprint = gallery_fingerprint(encodings, student_ids)
+    index = None
+    if os.path.exists(path):
+        try:
+            index = IVFIndex.load(path)
+        except (OSError, ValueError, KeyError):
+            index = None
+
+    if index is not None and nprobe:
+        index.nprobe = nprobe
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+
+    if index is not None and index.centroids.shape[1] == np.asarray(encodings).shape[1]:
+        index.assign(encodings)
+    else:
+        index = IVFIndex.train(encodings, nlist=nlist, nprobe=nprobe or DEFAULT_NPROBE)
+    index.fingerprint = fingerprint
+    index.save(path)
+    return index
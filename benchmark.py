@@ -0,0 +1,434 @@
+import argparse
+import json
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from database import (close_thread_connections, decode_face_encodings, encode_face_encoding,
+                      get_attendance_report, get_connection, get_faculty_attendance,
+                      get_student_attendance, init_logs_db, query_logs, rebuild_rollups)
+from face_gallery import DESCRIPTOR_SIZE, FaceGallery
+from model_registry import get_registry
+from motion_gate import MotionGate
+from recognition_engine import RecognitionEngine, draw_faces, open_source
+
+try:
+    # Этап отрисовки в Qt замеряется, только если установлен PyQt5
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import QSize, Qt
+    from PyQt5.QtGui import QGuiApplication, QImage, QPixmap
+    from video_pipeline import FrameRenderer
+except ImportError:
+    QGuiApplication = None
+
+STAGES = ('decode', 'gate', 'detect', 'landmarks', 'descriptor', 'match', 'render')
+
+# Приложение Qt процесса: без ссылки на него Python сразу его уничтожает
+_qt_app = None
+
+
+def ensure_qt_app():
+    """Создать QGuiApplication, если его еще нет (QPixmap требует существующего экземпляра)"""
+    global _qt_app
+    if QGuiApplication.instance() is None:
+        _qt_app = QGuiApplication([])
+
+
+def synthetic_gallery(size, seed=0, templates=1):
+    """Галерея из size случайных людей по templates шаблонов (масштаб как у дескрипторов dlib)
+
+    Шаблоны одного человека — его дескриптор с небольшим шумом, как у
+    снимков одной серии регистрации.
+    """
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0.0, 0.09, size=(size, DESCRIPTOR_SIZE)).astype(np.float32)
+    if templates > 1:
+        noise = rng.normal(0.0, 0.01, size=(size, templates, DESCRIPTOR_SIZE))
+        encodings = (encodings[:, None, :] + noise).reshape(-1, DESCRIPTOR_SIZE).astype(np.float32)
+    ids = [f"SYN{i:07d}" for i in range(size) for _ in range(templates)]
+    return FaceGallery(encodings, ids, np.repeat(np.arange(size), templates), ids)
+
+
+def latency_stats(values):
+    """Перцентили задержки этапа в миллисекундах"""
+    if not values:
+        return {'count': 0}
+    ms = np.asarray(values) * 1000.0
+    return {
+        'count': len(ms),
+        'mean_ms': round(float(ms.mean()), 3),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p90_ms': round(float(np.percentile(ms, 90)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'max_ms': round(float(ms.max()), 3),
+    }
+
+
+def benchmark_stream(engine, frames, continuous=True, max_frames=None, render_size=(800, 600),
+                     source_fps=30.0):
+    """Прогон кадров через этапы детекции, landmarks, дескриптора, поиска и отрисовки
+
+    Детектор движения (если он включен у движка) живет по времени видео:
+    кадр i считается снятым в момент i / source_fps.
+    """
+    timings = {}
+    frame_count = 0
+    face_count = 0
+    qt_size = QSize(*render_size) if QGuiApplication is not None else None
+    renderer = FrameRenderer() if qt_size is not None else None
+
+    engine.reset()
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    frames = iter(frames)
+    while max_frames is None or frame_count < max_frames:
+        t0 = time.perf_counter()
+        frame = next(frames, None)
+        if frame is None:
+            break
+        timings.setdefault('decode', []).append(time.perf_counter() - t0)
+
+        if not continuous:
+            engine.reset()
+        faces = engine.process(frame, timings, now=frame_count / source_fps)
+
+        t0 = time.perf_counter()
+        if renderer is not None:
+            image, scale = renderer.fit(frame, qt_size)
+            draw_faces(image, faces, scale)
+            renderer.pixmap(image)
+        else:
+            draw_faces(frame, faces)
+        timings.setdefault('render', []).append(time.perf_counter() - t0)
+
+        frame_count += 1
+        face_count += len(faces)
+    wall_time = time.perf_counter() - started
+    cpu_time = time.process_time() - cpu_started
+
+    return {
+        'frames': frame_count,
+        'faces': face_count,
+        'wall_time_s': round(wall_time, 3),
+        'fps': round(frame_count / wall_time, 2) if wall_time > 0 else 0.0,
+        'faces_per_second': round(face_count / wall_time, 2) if wall_time > 0 else 0.0,
+        'cpu_ms_per_frame': round(cpu_time * 1000.0 / frame_count, 3) if frame_count else 0.0,
+        'stages': {stage: latency_stats(timings.get(stage, [])) for stage in STAGES},
+    }
+
+
+def legacy_frame_to_pixmap(frame, size):
+    """Прежняя отрисовка для сравнения: копия RGB, QPixmap и сглаженное масштабирование в Qt"""
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    h, w, ch = rgb.shape
+    qimg = QImage(rgb.data, w, h, ch * w, QImage.Format_RGB888)
+    return QPixmap.fromImage(qimg).scaled(size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+
+
+def benchmark_render(frames=300, frame_size=(1280, 720), widget_size=(800, 600), seed=0):
+    """Отрисовка кадра в виджете: прежний путь против FrameRenderer
+
+    Кроме задержки замеряется объем памяти, выделяемой Python и numpy за
+    кадр (tracemalloc; память самого Qt сюда не попадает).
+    """
+    rng = np.random.default_rng(seed)
+    width, height = frame_size
+    # Несколько разных кадров, чтобы не замерять горячий кэш одного
+    samples_frames = [rng.integers(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+    faces = [((width // 3, height // 4, width // 2, height // 2), (1, "SYN0000001", "Synthetic", 0.3))]
+    qt_size = QSize(*widget_size)
+    renderer = FrameRenderer()
+
+    def legacy(frame):
+        draw_faces(frame, faces)
+        return legacy_frame_to_pixmap(frame, qt_size)
+
+    def resize_first(frame):
+        image, scale = renderer.fit(frame, qt_size)
+        draw_faces(image, faces, scale)
+        return renderer.pixmap(image)
+
+    results = {'frame_size': list(frame_size), 'widget_size': list(widget_size)}
+    for name, render in (('legacy', legacy), ('resize_first', resize_first)):
+        render(samples_frames[0].copy())
+        samples, allocated = [], []
+        tracemalloc.start()
+        for i in range(frames):
+            # Прежний путь рисует рамки прямо на кадре — каждому прогону
+            # свежая копия, сделанная вне замера (как кадр с камеры)
+            frame = samples_frames[i % len(samples_frames)].copy()
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            t0 = time.perf_counter()
+            render(frame)
+            samples.append(time.perf_counter() - t0)
+            allocated.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        stats = latency_stats(samples)
+        stats['peak_alloc_kb_per_frame'] = round(float(np.mean(allocated)) / 1024, 1)
+        results[name] = stats
+    return results
+
+
+def benchmark_matching(gallery, batch_sizes=(1, 4, 16), repeats=50, seed=1):
+    """Задержка поиска в галерее отдельно от видео — для оценки масштабирования"""
+    rng = np.random.default_rng(seed)
+    results = {}
+    for batch in batch_sizes:
+        queries = rng.normal(0.0, 0.09, size=(batch, DESCRIPTOR_SIZE)).astype(np.float32)
+        samples = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            gallery.match(queries)
+            samples.append(time.perf_counter() - t0)
+        results[f"batch_{batch}"] = latency_stats(samples)
+    return results
+
+
+def benchmark_encoding_storage(rows, repeats=5, seed=0):
+    """Сравнение загрузки encodings: старый формат (pickle float64) и blob float32
+
+    Для каждого формата создается временная база с rows записями; замеряется
+    SELECT + декодирование в матрицу галереи и размер файла базы.
+    """
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0.0, 0.09, size=(rows, DESCRIPTOR_SIZE))
+    formats = {
+        'pickle_float64': (lambda e: pickle.dumps(e),
+                           lambda blobs: np.array([pickle.loads(b) for b in blobs], dtype=np.float32)),
+        'blob_float32': (encode_face_encoding, decode_face_encodings),
+    }
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (encode, decode) in formats.items():
+            path = os.path.join(tmp, f"{name}.db")
+            conn = sqlite3.connect(path)
+            conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, face_encoding BLOB)")
+            conn.executemany("INSERT INTO users (face_encoding) VALUES (?)",
+                             ((encode(e),) for e in encodings))
+            conn.commit()
+
+            samples = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                blobs = [row[0] for row in conn.execute("SELECT face_encoding FROM users")]
+                decode(blobs)
+                samples.append(time.perf_counter() - t0)
+            conn.close()
+
+            results[name] = {
+                'load': latency_stats(samples),
+                'db_size_bytes': os.path.getsize(path),
+            }
+    return results
+
+
+def _synthetic_log_rows(start, count, rng, students=5000):
+    """Синтетические события журнала: по одному каждые ~3 секунды начиная с 2024 года"""
+    base = np.datetime64('2024-01-01T00:00:00')
+    seconds = (np.arange(start, start + count) * 3).astype('timedelta64[s]')
+    timestamps = np.datetime_as_string(base + seconds).astype(object)
+    student_ids = rng.integers(0, students, size=count)
+    actions = rng.integers(0, 2, size=count)
+    locations = rng.integers(0, 4, size=count)
+    for ts, sid, action, location in zip(timestamps, student_ids, actions, locations):
+        yield (int(sid), f"ST{sid:05d}", f"Student {sid}", ("Вход", "Выход")[action],
+               f"Gate {location}", ts.replace("T", " "))
+
+
+def benchmark_log_queries(rows, repeats=20, page_size=100, seed=0):
+    """Время выборки страницы журнала при росте таблицы до rows записей
+
+    Таблица заполняется синтетическими событиями; на каждом десятикратном
+    шаге роста замеряются запросы query_logs (первая страница, страница из
+    середины по курсору, фильтры, режим after_id) и для сравнения глубокая
+    страница через OFFSET.
+    """
+    rng = np.random.default_rng(seed)
+    checkpoints = sorted({rows // 10 ** k for k in range(4) if rows // 10 ** k >= 1000} | {rows})
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access_logs.db")
+        init_logs_db(path)
+        conn = get_connection(path)
+        filled = 0
+        for size in checkpoints:
+            while filled < size:
+                chunk = min(size - filled, 100000)
+                with conn:
+                    conn.executemany("""INSERT INTO access_logs (user_id, student_id, full_name, action, location, timestamp) 
+                                      VALUES (?, ?, ?, ?, ?, ?)""", _synthetic_log_rows(filled, chunk, rng))
+                filled += chunk
+
+            mid_id = size // 2
+            mid_ts = conn.execute("SELECT timestamp FROM access_logs WHERE id = ?", (mid_id,)).fetchone()[0]
+            day_start = mid_ts[:10] + " 00:00:00"
+            queries = {
+                'first_page': lambda: query_logs(limit=page_size, path=path),
+                'cursor_page_middle': lambda: query_logs(cursor=(mid_ts, mid_id), limit=page_size, path=path),
+                'student_filter': lambda: query_logs(student_id="ST00042", limit=page_size, path=path),
+                'location_action_day': lambda: query_logs(location="Gate 1", action="Вход", since=day_start,
+                                                          until=mid_ts, limit=page_size, path=path),
+                'after_id': lambda: query_logs(after_id=size - page_size, limit=page_size, path=path),
+                'offset_page_middle': lambda: conn.execute(
+                    """SELECT id, student_id, full_name, action, location, timestamp FROM access_logs 
+                       ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?""", (page_size, size // 2)).fetchall(),
+            }
+            stats = {}
+            for name, query in queries.items():
+                samples = []
+                for _ in range(repeats):
+                    t0 = time.perf_counter()
+                    query()
+                    samples.append(time.perf_counter() - t0)
+                stats[name] = latency_stats(samples)
+            results[f"rows_{size}"] = stats
+        close_thread_connections()
+    return results
+
+
+def benchmark_rollups(rows, repeats=10, seed=0):
+    """Отчеты о посещаемости по дневным сводкам и прямым сканированием журнала
+
+    Журнал из rows синтетических событий (5000 студентов, 10 факультетов);
+    замеряется пересчет сводок (rebuild_rollups) и отчеты за весь период:
+    по студентам и по факультетам.
+    """
+    rng = np.random.default_rng(seed)
+    faculties = {f"ST{i:05d}": f"Faculty {i % 10}" for i in range(5000)}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "access_logs.db")
+        init_logs_db(path)
+        conn = get_connection(path)
+        for start in range(0, rows, 100000):
+            with conn:
+                conn.executemany("""INSERT INTO access_logs (user_id, student_id, full_name, action, location, timestamp) 
+                                  VALUES (?, ?, ?, ?, ?, ?)""",
+                                 _synthetic_log_rows(start, min(rows - start, 100000), rng))
+        since, until = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM access_logs").fetchone()
+        since, until = since[:10], until[:10] + "~"
+
+        t0 = time.perf_counter()
+        rebuild_rollups(faculties, path)
+        results['rebuild_s'] = round(time.perf_counter() - t0, 3)
+
+        queries = {
+            'students_rollup': lambda: get_attendance_report(since, until, path),
+            'faculties_rollup': lambda: get_faculty_attendance(since=since, until=until, path=path),
+            'one_student_rollup': lambda: get_student_attendance("ST00042", since, until, path),
+            'students_raw_scan': lambda: conn.execute(
+                """SELECT student_id, COUNT(DISTINCT substr(timestamp, 1, 10)), SUM(action = 'Вход') 
+                   FROM access_logs WHERE timestamp >= ? AND timestamp < ? GROUP BY student_id""",
+                (since, until)).fetchall(),
+        }
+        for name, query in queries.items():
+            samples = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                query()
+                samples.append(time.perf_counter() - t0)
+            results[name] = latency_stats(samples)
+        close_thread_connections()
+    return results
+
+
+def benchmark_recognition(args):
+    """Бенчмарк распознавания по источнику кадров из аргументов командной строки"""
+    gallery = None
+    if args.gallery_size:
+        gallery = synthetic_gallery(args.gallery_size, templates=args.templates_per_identity)
+        # Индекс синтетической галереи не должен затирать индекс рабочей базы
+        gallery.enable_ann(os.path.join(
+            tempfile.gettempdir(),
+            f"synthetic_{args.gallery_size}x{args.templates_per_identity}.ivf.npz"))
+    motion_gate = MotionGate.for_camera(args.source) if args.motion_gate else None
+    engine = RecognitionEngine(gallery=gallery, motion_gate=motion_gate)
+    if args.no_tracking:
+        engine.tracker.reid_interval = 1
+
+    if QGuiApplication is not None:
+        ensure_qt_app()
+
+    frames, continuous = open_source(args.source)
+    report = {
+        'source': args.source,
+        'gallery_size': len(engine.gallery),
+        'gallery_identities': engine.gallery.identity_count(),
+        'ann_index': engine.gallery.index is not None,
+        'tracking': not args.no_tracking,
+    }
+    report.update(benchmark_stream(engine, frames, continuous, args.max_frames,
+                                   source_fps=args.source_fps))
+    report['quality'] = dict(engine.quality_stats)
+    if motion_gate is not None:
+        report['motion_gate'] = motion_gate.summary()
+    report['matching'] = benchmark_matching(engine.gallery)
+    report['models'] = get_registry().report()
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Офлайн-бенчмарк распознавания по видеофайлу или папке с изображениями")
+    parser.add_argument("--source", help="видеофайл или папка с изображениями")
+    parser.add_argument("--gallery-size", type=int, default=0,
+                        help="размер синтетической галереи (0 — галерея из базы)")
+    parser.add_argument("--templates-per-identity", type=int, default=1,
+                        help="шаблонов лица на человека в синтетической галерее")
+    parser.add_argument("--max-frames", type=int, default=None)
+    parser.add_argument("--no-tracking", action="store_true",
+                        help="вычислять дескриптор для каждого лица на каждом кадре")
+    parser.add_argument("--motion-gate", action="store_true",
+                        help="пропускать детекцию, пока сцена неподвижна и пуста (motion_gate.py)")
+    parser.add_argument("--source-fps", type=float, default=30.0,
+                        help="частота кадров источника — время видео для --motion-gate")
+    parser.add_argument("--storage-rows", type=int, default=0,
+                        help="сравнить загрузку encodings из базы на N синтетических записях")
+    parser.add_argument("--log-rows", type=int, default=0,
+                        help="замерить запросы журнала доступа при росте таблицы до N записей")
+    parser.add_argument("--rollup-rows", type=int, default=0,
+                        help="сравнить отчеты о посещаемости по сводкам и по журналу из N событий")
+    parser.add_argument("--render-frames", type=int, default=0,
+                        help="сравнить прежнюю и новую отрисовку кадра в Qt на N кадрах")
+    parser.add_argument("--frame-size", default="1280x720",
+                        help="размер синтетического кадра для --render-frames (ШxВ)")
+    parser.add_argument("--output", help="путь для JSON-отчета")
+    args = parser.parse_args(argv)
+    if not (args.source or args.storage_rows or args.log_rows or args.rollup_rows
+            or args.render_frames):
+        parser.error("нужен --source, --storage-rows, --log-rows, --rollup-rows и/или --render-frames")
+    if args.render_frames and QGuiApplication is None:
+        parser.error("для --render-frames нужен PyQt5")
+
+    report = {}
+    if args.storage_rows:
+        report['storage'] = benchmark_encoding_storage(args.storage_rows)
+    if args.log_rows:
+        report['access_logs'] = benchmark_log_queries(args.log_rows)
+    if args.rollup_rows:
+        report['attendance'] = benchmark_rollups(args.rollup_rows)
+    if args.render_frames:
+        ensure_qt_app()
+        frame_size = tuple(int(v) for v in args.frame_size.lower().split("x"))
+        report['render'] = benchmark_render(args.render_frames, frame_size)
+    if args.source:
+        report.update(benchmark_recognition(args))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
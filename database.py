@@ -1,14 +1,162 @@
 import sqlite3
 import pickle
-from datetime import datetime
+import threading
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timezone
+from urllib.request import pathname2url
+
+import numpy as np
+
+from file_lock import FileLock
+
+# ==================== СОЕДИНЕНИЯ ====================
+
+# Соединения открываются один раз на поток и базу и переиспользуются:
+# функции ниже не платят за connect и DDL на каждый вызов
+_local = threading.local()
+
+# Базы, соединения с которыми закрыты retire_connections: {path: номер
+# вызова}. Потоки сверяют номер при следующем get_connection и закрывают
+# свои соединения, открытые до него
+_retired = {}
+_retire_count = 0
+_retire_lock = threading.Lock()
+
+def get_connection(path, readonly=False):
+    """Постоянное соединение текущего потока с базой path
+
+    Базы работают в режиме WAL: читатели не блокируют писателя и наоборот.
+    synchronous=NORMAL в WAL не портит базу при сбое, но последние
+    транзакции до контрольной точки могут быть потеряны при отключении питания.
+    readonly=True открывает базу только для чтения (партиции журнала).
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+        _local.opened = {}
+        _local.checked = 0
+    retire_count = _retire_count
+    if _local.checked != retire_count:
+        _local.checked = retire_count
+        for stale in [p for p in connections if _retired.get(p, 0) > _local.opened[p]]:
+            connections.pop(stale).close()
+    conn = connections.get(path)
+    if conn is None:
+        if readonly:
+            conn = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=ro",
+                                   uri=True, timeout=10)
+        else:
+            conn = sqlite3.connect(path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")
+        connections[path] = conn
+        _local.opened[path] = retire_count
+    return conn
+
+def close_thread_connections():
+    """Закрыть соединения текущего потока (вызывается при завершении рабочих потоков)"""
+    connections = getattr(_local, 'connections', None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+def close_connection(path):
+    """Закрыть соединение текущего потока с базой path (перед удалением файла)"""
+    connections = getattr(_local, 'connections', None) or {}
+    conn = connections.pop(path, None)
+    if conn is not None:
+        conn.close()
+
+def retire_connections(path):
+    """Закрыть соединения с базой path во всех потоках (перед удалением файла)
+
+    Соединение текущего потока закрывается сразу, остальные потоки
+    закрывают свои при следующем обращении к любой базе. Пока они этого
+    не сделали, файл может быть открыт (в Windows его не удалить).
+    """
+    global _retire_count
+    close_connection(path)
+    with _retire_lock:
+        _retire_count += 1
+        _retired[path] = _retire_count
+
+def keyset_page(conn, sql, conditions, params, keys, descending=True, cursor=None, limit=100):
+    """Страница выборки с keyset-пагинацией (без OFFSET)
+
+    sql — "SELECT ... FROM ..." без WHERE и ORDER BY; keys — столбцы
+    сортировки, последний из них уникален (обычно id); cursor — значения
+    keys последней строки предыдущей страницы. Каждая страница читается
+    по индексу на keys за время, не зависящее от ее номера.
+
+    Возвращает словарь rows, has_more и cursor (None на последней странице).
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if cursor is not None:
+        conditions.append(f"({', '.join(keys)}) {'<' if descending else '>'} "
+                          f"({', '.join('?' * len(keys))})")
+        params.extend(cursor)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    direction = " DESC" if descending else ""
+    order = ", ".join(key + direction for key in keys)
+
+    cur = conn.cursor()
+    # Читается на одну запись больше, чтобы знать, есть ли следующая страница
+    cur.execute(f"{sql}{where} ORDER BY {order} LIMIT ?", params + [limit + 1])
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        names = [d[0] for d in cur.description]
+        positions = [names.index(key) for key in keys]
+        next_cursor = tuple(rows[-1][i] for i in positions)
+    return {
+        'rows': rows,
+        'has_more': has_more,
+        'cursor': next_cursor,
+    }
 
 # ==================== БАЗА ДАННЫХ ПОЛЬЗОВАТЕЛЕЙ ====================
 
 DB_USERS = "users_registry.db"
 
+# Формат хранения face encoding: 4 байта заголовка (сигнатура + версия)
+# и 128 значений float32 little-endian (512 байт)
+ENCODING_VERSION = 1
+ENCODING_HEADER = b"FE" + bytes([ENCODING_VERSION, 0])
+ENCODING_SIZE = 128
+ENCODING_BLOB_SIZE = len(ENCODING_HEADER) + ENCODING_SIZE * 4
+
+def encode_face_encoding(encoding):
+    """Упаковка face encoding в бинарный blob (заголовок + float32)"""
+    data = np.asarray(encoding, dtype='<f4').reshape(ENCODING_SIZE)
+    return ENCODING_HEADER + data.tobytes()
+
+def decode_face_encodings(blobs):
+    """Распаковка списка blob-ов одной операцией в матрицу (N x 128) float32"""
+    if not blobs:
+        return np.empty((0, ENCODING_SIZE), dtype=np.float32)
+    raw = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+    if len(raw) != len(blobs) * ENCODING_BLOB_SIZE:
+        raise ValueError("Неизвестный формат face encoding (нужна миграция базы)")
+    rows = raw.reshape(len(blobs), ENCODING_BLOB_SIZE)
+    if not (rows[:, :len(ENCODING_HEADER)] == np.frombuffer(ENCODING_HEADER, dtype=np.uint8)).all():
+        raise ValueError("Неизвестный формат face encoding (нужна миграция базы)")
+    return rows[:, len(ENCODING_HEADER):].copy().view('<f4').astype(np.float32, copy=False)
+
 def init_db():
     """Инициализация базы данных пользователей"""
-    conn = sqlite3.connect(DB_USERS)
+    conn = get_connection(DB_USERS)
     cur = conn.cursor()
     cur.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -22,81 +170,267 @@ def init_db():
             registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    
+    # Лента изменений таблицы users: каждая вставка, изменение и удаление
+    # получает монотонно растущий seq. По ней галерея и ее снимок
+    # догружают только изменившиеся записи
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            op TEXT NOT NULL
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_changes_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_changes (user_id, op) VALUES (NEW.id, 'insert');
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_changes_update AFTER UPDATE ON users
+        BEGIN
+            INSERT INTO users_changes (user_id, op) VALUES (NEW.id, 'update');
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_changes_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_changes (user_id, op) VALUES (OLD.id, 'delete');
+        END
+    """)
+    # Идентификатор базы: лента изменений новой или восстановленной базы
+    # начинается заново, и снимок галереи сверяет не только номер seq
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS users_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    cur.execute("INSERT OR IGNORE INTO users_meta (key, value) VALUES ('db_id', ?)", (uuid.uuid4().hex,))
+    # Шаблоны лица: несколько дескрипторов на пользователя (регистрация
+    # серией кадров). users.face_encoding хранит лучший из них
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS face_templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            encoding BLOB NOT NULL,
+            quality REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_face_templates_user ON face_templates (user_id, id)")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS face_templates_on_user_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM face_templates WHERE user_id = OLD.id;
+        END
+    """)
+    # Изменения шаблонов попадают в ту же ленту: новые шаблоны только что
+    # добавленного пользователя ('template') дописываются в конец галереи
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS face_templates_changes_insert AFTER INSERT ON face_templates
+        BEGIN
+            INSERT INTO users_changes (user_id, op) VALUES (NEW.user_id, 'template');
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS face_templates_changes_delete AFTER DELETE ON face_templates
+        BEGIN
+            INSERT INTO users_changes (user_id, op) VALUES (OLD.user_id, 'update');
+        END
+    """)
+    # Индексы под сортировку таблицы пользователей в панели администратора
+    for column in ('first_name', 'last_name', 'faculty', 'registered_at'):
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_users_{column} ON users ({column}, id)")
     conn.commit()
-    conn.close()
 
-def save_face_encoding(student_id, first_name, last_name, faculty, encoding):
-    """Сохранение пользователя с face encoding"""
-    init_db()
-    conn = sqlite3.connect(DB_USERS)
-    cur = conn.cursor()
+def save_face_templates(student_id, first_name, last_name, faculty, templates):
+    """Сохранение пользователя с несколькими шаблонами лица
+
+    templates — список (encoding, quality), лучший шаблон первым: он же
+    записывается в users.face_encoding. Пользователь и шаблоны
+    сохраняются в одной транзакции.
+    """
+    conn = get_connection(DB_USERS)
     try:
-        cur.execute("""INSERT INTO users (student_id, first_name, last_name, faculty, face_encoding) 
-                      VALUES (?, ?, ?, ?, ?)""",
-                   (student_id, first_name, last_name, faculty, pickle.dumps(encoding)))
-        conn.commit()
-        conn.close()
+        with conn:
+            cur = conn.execute("""INSERT INTO users (student_id, first_name, last_name, faculty, face_encoding) 
+                                VALUES (?, ?, ?, ?, ?)""",
+                               (student_id, first_name, last_name, faculty,
+                                encode_face_encoding(templates[0][0])))
+            conn.executemany("INSERT INTO face_templates (user_id, encoding, quality) VALUES (?, ?, ?)",
+                             [(cur.lastrowid, encode_face_encoding(encoding), quality)
+                              for encoding, quality in templates])
         return True
     except sqlite3.IntegrityError:
-        conn.close()
         return False
 
-def load_all_encodings():
-    """Загрузка всех face encodings с полной информацией пользователей"""
-    init_db()
-    conn = sqlite3.connect(DB_USERS)
+# Шаблоны вместе с данными пользователя в формате строк галереи
+_TEMPLATE_ROWS = """SELECT u.id, u.student_id, u.first_name, u.last_name, t.encoding 
+                    FROM face_templates t JOIN users u ON u.id = t.user_id"""
+
+def _db_id(cur):
+    cur.execute("SELECT value FROM users_meta WHERE key = 'db_id'")
+    return cur.fetchone()[0]
+
+def load_gallery_rows():
+    """Загрузка всех шаблонов лиц сразу в виде матрицы для FaceGallery
+
+    Возвращает словарь:
+      db_id — идентификатор базы,
+      seq — номер ленты изменений, которому соответствуют данные,
+      rows — (encodings, student_ids, user_ids, names) по строке на шаблон,
+             шаблоны одного пользователя подряд; encodings — матрица
+             (N x 128) float32, декодированная одной операцией.
+    """
+    conn = get_connection(DB_USERS)
     cur = conn.cursor()
-    cur.execute("SELECT id, student_id, first_name, last_name, face_encoding FROM users WHERE face_encoding IS NOT NULL")
-    rows = cur.fetchall()
-    conn.close()
+    # Номер ленты и данные читаются в одной транзакции
+    cur.execute("BEGIN")
+    try:
+        db_id = _db_id(cur)
+        cur.execute("SELECT COALESCE(MAX(seq), 0) FROM users_changes")
+        seq = cur.fetchone()[0]
+        cur.execute(f"{_TEMPLATE_ROWS} ORDER BY t.user_id, t.id")
+        rows = cur.fetchall()
+    finally:
+        conn.rollback()
     
-    users = {}
-    for user_id, student_id, first_name, last_name, enc_blob in rows:
-        full_name = f"{first_name} {last_name}"
-        users[student_id] = {
-            'id': user_id,
-            'name': full_name,
-            'encoding': pickle.loads(enc_blob)
-        }
-    return users
-
-def get_all_users():
-    """Получить список всех пользователей"""
-    init_db()
-    conn = sqlite3.connect(DB_USERS)
+    return {
+        'db_id': db_id,
+        'seq': seq,
+        'rows': (decode_face_encodings([row[4] for row in rows]),
+                 [row[1] for row in rows],
+                 [row[0] for row in rows],
+                 [f"{row[2]} {row[3]}" for row in rows]),
+    }
+
+def get_user_changes(since_seq):
+    """Изменения пользователей после since_seq из ленты users_changes
+
+    Возвращает словарь:
+      db_id — идентификатор базы,
+      seq — последний номер в ленте (меньше since_seq, если база заменена
+             или восстановлена из копии — тогда изменения неполны и галерею
+             нужно перечитать целиком, как и при другом db_id),
+      only_inserts — True, если все изменения были добавлениями новых
+             пользователей (вместе с их шаблонами),
+      rows — (encodings, student_ids, user_ids, names): все шаблоны
+             добавленных или измененных пользователей, подряд по user_id,
+      removed — user_id удаленных пользователей (или оставшихся без шаблонов).
+    """
+    conn = get_connection(DB_USERS)
     cur = conn.cursor()
-    cur.execute("SELECT id, student_id, first_name, last_name, faculty, registered_at FROM users ORDER BY id DESC")
-    users = cur.fetchall()
-    conn.close()
-    return users
+    # Все запросы выполняются в одной транзакции чтения
+    cur.execute("BEGIN")
+    try:
+        # Шаблоны, добавленные существующему пользователю, — не добавление:
+        # его строки в галерее пришлось бы переносить
+        db_id = _db_id(cur)
+        cur.execute("SELECT COALESCE(MAX(seq), 0) FROM users_changes")
+        seq = cur.fetchone()[0]
+        cur.execute("""SELECT COALESCE(SUM(op != 'insert' AND NOT (op = 'template' AND user_id IN (
+                                 SELECT user_id FROM users_changes WHERE seq > ? AND op = 'insert'))), 0) 
+                      FROM users_changes WHERE seq > ?""", (since_seq, since_seq))
+        rewrites = cur.fetchone()[0]
+        cur.execute(f"""{_TEMPLATE_ROWS} 
+                       WHERE t.user_id IN (SELECT user_id FROM users_changes WHERE seq > ?) 
+                       ORDER BY t.user_id, t.id""", (since_seq,))
+        rows = cur.fetchall()
+        cur.execute("""SELECT DISTINCT user_id FROM users_changes WHERE seq > ? 
+                      AND user_id NOT IN (SELECT user_id FROM face_templates)""",
+                   (since_seq,))
+        removed = [row[0] for row in cur.fetchall()]
+    finally:
+        conn.rollback()
+    
+    return {
+        'db_id': db_id,
+        'seq': seq,
+        'only_inserts': rewrites == 0,
+        'rows': (decode_face_encodings([row[4] for row in rows]),
+                 [row[1] for row in rows],
+                 [row[0] for row in rows],
+                 [f"{row[2]} {row[3]}" for row in rows]),
+        'removed': removed,
+    }
+
+def migrate_face_encodings():
+    """Перевод старых записей (pickle float64) в бинарный формат float32 на месте
+
+    Возвращает количество перекодированных записей.
+    """
+    conn = get_connection(DB_USERS)
+    cur = conn.cursor()
+    cur.execute("""SELECT id, face_encoding FROM users 
+                  WHERE face_encoding IS NOT NULL AND substr(face_encoding, 1, ?) != ?""",
+               (len(ENCODING_HEADER), ENCODING_HEADER))
+    rows = cur.fetchall()
+    # pickle.loads применяется только здесь, к записям, созданным старой версией приложения
+    with conn:
+        conn.executemany("UPDATE users SET face_encoding=? WHERE id=?",
+                         [(encode_face_encoding(pickle.loads(blob)), user_id) for user_id, blob in rows])
+    return len(rows)
+
+def migrate_face_templates():
+    """Перенос encoding пользователей без шаблонов в face_templates (один шаблон)
+
+    Возвращает количество перенесенных записей.
+    """
+    conn = get_connection(DB_USERS)
+    with conn:
+        cur = conn.execute("""INSERT INTO face_templates (user_id, encoding) 
+                             SELECT id, face_encoding FROM users 
+                             WHERE face_encoding IS NOT NULL 
+                             AND id NOT IN (SELECT user_id FROM face_templates) ORDER BY id""")
+    return cur.rowcount
+
+# Столбцы, по которым можно сортировать query_users (сортировка по (столбец, id))
+USER_SORT_COLUMNS = ('id', 'student_id', 'first_name', 'last_name', 'faculty', 'registered_at')
+
+def query_users(search=None, order_by='id', descending=True, cursor=None, limit=100):
+    """Постраничная выборка пользователей с поиском и сортировкой в SQL
+
+    search — подстрока ID студента, имени, фамилии или факультета;
+    order_by — один из USER_SORT_COLUMNS. Страницы листаются курсором
+    из предыдущего ответа (см. keyset_page).
+    """
+    if order_by not in USER_SORT_COLUMNS:
+        raise ValueError(f"Нельзя сортировать пользователей по {order_by}")
+    conditions = []
+    params = []
+    if search:
+        conditions.append("(student_id LIKE ? OR first_name LIKE ? OR last_name LIKE ? OR faculty LIKE ?)")
+        params.extend([f"%{search}%"] * 4)
+    keys = ('id',) if order_by == 'id' else (order_by, 'id')
+    return keyset_page(get_connection(DB_USERS),
+                       "SELECT id, student_id, first_name, last_name, faculty, registered_at FROM users",
+                       conditions, params, keys, descending, cursor, limit)
 
 def get_user_by_student_id(student_id):
     """Получить информацию о пользователе по student_id"""
-    conn = sqlite3.connect(DB_USERS)
+    conn = get_connection(DB_USERS)
     cur = conn.cursor()
     cur.execute("SELECT id, student_id, first_name, last_name, faculty FROM users WHERE student_id=?", (student_id,))
     user = cur.fetchone()
-    conn.close()
     return user
 
 def delete_user(user_id):
     """Удалить пользователя"""
-    conn = sqlite3.connect(DB_USERS)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM users WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    conn = get_connection(DB_USERS)
+    with conn:
+        conn.execute("DELETE FROM users WHERE id=?", (user_id,))
 
 # ==================== БАЗА ДАННЫХ ЛОГОВ ДОСТУПА ====================
 
 DB_LOGS = "access_logs.db"
 
-def init_logs_db():
-    """Инициализация базы данных логов"""
-    conn = sqlite3.connect(DB_LOGS)
+def _create_logs_schema(conn, schema="main"):
+    """Таблица access_logs и ее индексы в базе schema (основной или партиции)"""
     cur = conn.cursor()
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS access_logs (
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.access_logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER,
             student_id TEXT,
@@ -106,31 +440,750 @@ def init_logs_db():
             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     """)
+    # Индексы под постраничную выборку по (timestamp, id) и фильтры журнала
+    cur.execute(f"""CREATE INDEX IF NOT EXISTS {schema}.idx_access_logs_timestamp 
+                   ON access_logs (timestamp, id)""")
+    cur.execute(f"""CREATE INDEX IF NOT EXISTS {schema}.idx_access_logs_student 
+                   ON access_logs (student_id, timestamp, id)""")
+    cur.execute(f"""CREATE INDEX IF NOT EXISTS {schema}.idx_access_logs_location 
+                   ON access_logs (location, timestamp, id)""")
     conn.commit()
-    conn.close()
+
+def init_logs_db(path=DB_LOGS):
+    """Инициализация базы данных логов"""
+    conn = get_connection(path)
+    _create_logs_schema(conn)
+    _create_presence_schema(conn)
+    _create_rollup_schema(conn)
 
 def log_access(user_id, student_id, full_name, action, location="Main Entrance"):
     """Записать лог доступа (Вход/Выход)"""
-    init_logs_db()
-    conn = sqlite3.connect(DB_LOGS)
-    cur = conn.cursor()
-    cur.execute("""INSERT INTO access_logs (user_id, student_id, full_name, action, location) 
-                  VALUES (?, ?, ?, ?, ?)""",
-               (user_id, student_id, full_name, action, location))
-    conn.commit()
-    conn.close()
+    # Тот же формат и часовой пояс (UTC), что у CURRENT_TIMESTAMP в SQLite
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    insert_access_logs([(user_id, student_id, full_name, action, location, timestamp)])
+
+def insert_access_logs(rows):
+    """Записать пачку событий одной транзакцией
+
+    rows — кортежи (user_id, student_id, full_name, action, location, timestamp).
+    В той же транзакции обновляются presence (триггером) и дневные сводки.
+    """
+    rows = list(rows)
+    student_ids = {row[1] for row in rows}
+    faculties = _student_faculties(student_ids)
+    conn = get_connection(DB_LOGS)
+    with conn:
+        # Блокировка записи берется сразу: открытые визиты читаются
+        # согласованно с вставкой
+        conn.execute("BEGIN IMMEDIATE")
+        open_visits = _open_visits(conn, student_ids)
+        conn.executemany("""INSERT INTO access_logs (user_id, student_id, full_name, action, location, timestamp) 
+                          VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        _apply_rollups(conn, rows, open_visits, faculties)
+
+# ==================== ПАРТИЦИИ ЖУРНАЛА ====================
+
+# В access_logs.db хранится только текущий месяц. События прошлых месяцев
+# переносятся (rollover_logs) в помесячные базы-партиции, а партиции
+# старше LOGS_ARCHIVE_AFTER_MONTHS сжимаются в архивы только для чтения.
+# Архивы старше LOGS_RETENTION_MONTHS удаляются (None — хранить всегда).
+LOGS_ARCHIVE_AFTER_MONTHS = 3
+LOGS_RETENTION_MONTHS = None
+
+# Архивы распаковываются сюда при первом запросе к их месяцам
+LOGS_ARCHIVE_CACHE = os.path.join(tempfile.gettempdir(), "access_logs_archive")
+
+PARTITIONS_MANIFEST = "manifest.json"
+
+def logs_partition_dir(path=DB_LOGS):
+    """Папка партиций журнала рядом с основной базой"""
+    return os.path.splitext(path)[0] + ".parts"
+
+def _month_start(month):
+    return f"{month}-01 00:00:00"
+
+def _month_number(month):
+    year, mon = map(int, month.split('-'))
+    return year * 12 + mon - 1
+
+def _next_month(month):
+    number = _month_number(month) + 1
+    return f"{number // 12:04d}-{number % 12 + 1:02d}"
+
+def read_logs_manifest(path=DB_LOGS):
+    """Описание партиций: {месяц 'YYYY-MM': {file, archived, rows, min_id, max_id}}"""
+    try:
+        with open(os.path.join(logs_partition_dir(path), PARTITIONS_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_logs_manifest(manifest, path=DB_LOGS):
+    part_dir = logs_partition_dir(path)
+    tmp_path = os.path.join(part_dir, PARTITIONS_MANIFEST + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(part_dir, PARTITIONS_MANIFEST))
+
+def _unpack_archive(archive_path, target_path):
+    """Распаковать архив партиции (через временный файл, атомарно)"""
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    tmp_path = f"{target_path}.{os.getpid()}.tmp"
+    with gzip.open(archive_path, "rb") as src, open(tmp_path, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(tmp_path, target_path)
+
+def _move_month(conn, month, path):
+    """Перенести события месяца из основной базы в его партицию"""
+    part_dir = logs_partition_dir(path)
+    os.makedirs(part_dir, exist_ok=True)
+    manifest = read_logs_manifest(path)
+    part_path = os.path.join(part_dir, f"{month}.db")
+    info = manifest.get(month)
+    if info and info['archived']:
+        # Запоздавшие события уже заархивированного месяца: архив
+        # распаковывается обратно и будет сжат заново
+        _unpack_archive(os.path.join(part_dir, info['file']), part_path)
+
+    start, end = _month_start(month), _month_start(_next_month(month))
+    conn.execute("ATTACH DATABASE ? AS part", (part_path,))
+    try:
+        _create_logs_schema(conn, "part")
+        # Перенос повторяем без дублей: при сбое между коммитами двух файлов
+        # следующий rollover_logs доведет его до конца
+        with conn:
+            conn.execute("""INSERT OR IGNORE INTO part.access_logs 
+                          SELECT * FROM main.access_logs WHERE timestamp >= ? AND timestamp < ?""",
+                         (start, end))
+            conn.execute("DELETE FROM main.access_logs WHERE timestamp >= ? AND timestamp < ?",
+                         (start, end))
+        count, min_id, max_id = conn.execute(
+            "SELECT COUNT(*), MIN(id), MAX(id) FROM part.access_logs").fetchone()
+    finally:
+        conn.execute("DETACH DATABASE part")
+
+    manifest[month] = {'file': f"{month}.db", 'archived': False,
+                       'rows': count, 'min_id': min_id, 'max_id': max_id}
+    _write_logs_manifest(manifest, path)
+    if info and info['archived']:
+        os.remove(os.path.join(part_dir, info['file']))
+
+def _remove_partition_file(file_path):
+    """Удалить файл партиции, закрыв соединения с ним во всех потоках
+
+    Возвращает False, если файл еще открыт (в Windows): описание партиций
+    тогда не меняется, и удаление повторит следующий rollover_logs.
+    """
+    retire_connections(file_path)
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    return True
+
+def _archive_month(month, path):
+    """Сжать партицию месяца в архив только для чтения (False — повторить позже)"""
+    part_dir = logs_partition_dir(path)
+    part_path = os.path.join(part_dir, read_logs_manifest(path)[month]['file'])
+    archive_name = f"{month}.db.gz"
+
+    # Партиции нет, а архив есть: прошлый перенос прервался до публикации описания
+    if os.path.exists(part_path) or not os.path.exists(os.path.join(part_dir, archive_name)):
+        tmp_path = os.path.join(part_dir, archive_name + ".tmp")
+        with open(part_path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, os.path.join(part_dir, archive_name))
+    # Описание публикуется, только когда партиции уже нет: до этого
+    # читатели берут архив сами, если не найдут ее (см. _log_sources)
+    if not _remove_partition_file(part_path):
+        return False
+    manifest = read_logs_manifest(path)
+    manifest[month].update({'file': archive_name, 'archived': True})
+    _write_logs_manifest(manifest, path)
+    return True
+
+def rollover_logs(now=None, archive_after=None, retention=None, path=DB_LOGS):
+    """Перенос прошлых месяцев в партиции, архивирование и удаление старых архивов
+
+    archive_after и retention (в месяцах) по умолчанию берутся из
+    LOGS_ARCHIVE_AFTER_MONTHS и LOGS_RETENTION_MONTHS. Повторный вызов
+    в том же месяце ничего не делает. Запускается периодически фоновым
+    писателем журнала (log_writer) под межпроцессной блокировкой: если
+    перенос уже выполняет другой процесс, сразу возвращает None. Иначе
+    возвращает словарь со списками месяцев moved, archived и deleted.
+    """
+    lock = FileLock(logs_partition_dir(path) + ".lock")
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        return _rollover_logs(now, archive_after, retention, path)
+    finally:
+        lock.release()
+
+def _rollover_logs(now, archive_after, retention, path):
+    archive_after = LOGS_ARCHIVE_AFTER_MONTHS if archive_after is None else archive_after
+    retention = LOGS_RETENTION_MONTHS if retention is None else retention
+    current = (now or datetime.now(timezone.utc)).strftime('%Y-%m')
+    report = {'moved': [], 'archived': [], 'deleted': []}
+
+    conn = get_connection(path)
+    while True:
+        # MIN по индексу timestamp — перенос идет месяц за месяцем
+        oldest = conn.execute("SELECT MIN(timestamp) FROM access_logs").fetchone()[0]
+        if oldest is None or oldest >= _month_start(current):
+            break
+        _move_month(conn, oldest[:7], path)
+        report['moved'].append(oldest[:7])
+
+    age = lambda month: _month_number(current) - _month_number(month)
+    for month, info in sorted(read_logs_manifest(path).items()):
+        if retention is not None and age(month) > retention:
+            if not _remove_partition_file(os.path.join(logs_partition_dir(path), info['file'])):
+                continue
+            manifest = read_logs_manifest(path)
+            del manifest[month]
+            _write_logs_manifest(manifest, path)
+            report['deleted'].append(month)
+        elif not info['archived'] and age(month) > archive_after:
+            if _archive_month(month, path):
+                report['archived'].append(month)
+    return report
+
+def _log_sources(path, since=None, until=None):
+    """Базы, в которых могут быть события из интервала [since, until)
+
+    Для каждой — словарь с границами ключей сортировки (нижняя включительно,
+    верхняя исключительно; None — граница неизвестна): по ним query_logs
+    пропускает партиции, которые не могут попасть в страницу.
+    """
+    sources = [{'month': None, 'path': path, 'bounds': {}}]
+    for month, info in read_logs_manifest(path).items():
+        start, end = _month_start(month), _month_start(_next_month(month))
+        if (since is not None and end <= since) or (until is not None and start >= until):
+            continue
+        source_path = os.path.join(logs_partition_dir(path), info['file'])
+        archived = info['archived']
+        # Файл уже удален, а описание еще не обновлено: партиция сжата
+        # в архив или удалена по сроку хранения
+        if not os.path.exists(source_path):
+            if archived or not os.path.exists(source_path + ".gz"):
+                continue
+            source_path, archived = source_path + ".gz", True
+        sources.append({
+            'month': month,
+            'path': source_path,
+            'archived': archived,
+            'bounds': {
+                'timestamp': (start, end),
+                'id': (info['min_id'], info['max_id'] + 1) if info['rows'] else None,
+            },
+        })
+    return sources
+
+def _source_connection(source):
+    """Соединение с базой-источником; архив распаковывается в LOGS_ARCHIVE_CACHE"""
+    if source['month'] is None:
+        return get_connection(source['path'])
+    if not source['archived']:
+        return get_connection(source['path'], readonly=True)
+    # Имя копии зависит от полного пути архива: у разных баз журнала
+    # (например, рабочей и бенчмарка) одинаковые названия месяцев
+    digest = hashlib.sha1(os.path.abspath(source['path']).encode()).hexdigest()[:16]
+    cached = os.path.join(LOGS_ARCHIVE_CACHE, f"{source['month']}-{digest}.db")
+    if not os.path.exists(cached) or os.path.getmtime(cached) < os.path.getmtime(source['path']):
+        retire_connections(cached)
+        _unpack_archive(source['path'], cached)
+    return get_connection(cached, readonly=True)
+
+def _log_timestamp(value):
+    """Время в формате столбца timestamp (строка 'YYYY-MM-DD HH:MM:SS', UTC)"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+# Столбцы строк, которые возвращает query_logs
+LOG_COLUMNS = ('id', 'student_id', 'full_name', 'action', 'location', 'timestamp')
+
+# Сортировки журнала: ключ keyset-пагинации для каждой (все покрыты индексами)
+LOG_SORT_KEYS = {
+    'id': ('id',),
+    'timestamp': ('timestamp', 'id'),
+    'student_id': ('student_id', 'timestamp', 'id'),
+    'location': ('location', 'timestamp', 'id'),
+}
+
+def get_logs_data_version(path=DB_LOGS):
+    """Счетчик изменений базы журнала, сделанных другими соединениями
+
+    PRAGMA data_version не обращается к таблицам и меняется после коммита
+    в любом другом соединении — в том числе из другого процесса. Сравнение
+    с прошлым значением — дешевая проверка "появились ли новые события".
+    """
+    conn = get_connection(path)
+    return conn.execute("PRAGMA data_version").fetchone()[0]
+
+def get_last_log_id(path=DB_LOGS):
+    """Наибольший выданный id журнала (0, если событий еще не было)
+
+    Берется из sqlite_sequence: значение не уменьшается, когда события
+    переносятся в партиции.
+    """
+    conn = get_connection(path)
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'access_logs'").fetchone()
+    return row[0] if row else 0
+
+def _sort_value(value):
+    # NULL в SQLite меньше любого значения
+    return (value is not None, value)
+
+def query_logs(student_id=None, action=None, location=None, since=None, until=None,
+               order_by='timestamp', descending=True, cursor=None, after_id=None,
+               limit=100, path=DB_LOGS):
+    """Постраничная выборка журнала доступа с фильтрами
+
+    Фильтры: student_id, action, location и интервал времени [since, until)
+    (строки в формате timestamp или datetime в UTC).
+
+    Обычный режим — сортировка по order_by (один из LOG_SORT_KEYS), по
+    умолчанию от новых событий к старым; для следующей страницы передается
+    cursor из предыдущего ответа (см. keyset_page). Смещение (OFFSET) не
+    используется, поэтому любая страница читается по индексу за одинаковое
+    время независимо от размера таблицы.
+
+    Режим after_id — только события с id > after_id в порядке добавления
+    (для дозагрузки новых записей).
+
+    Запрос выполняется в основной базе и в партициях прошлых месяцев,
+    пересекающихся с [since, until); страницы партиций сливаются. При
+    сортировке по времени или id партиции, которые не могут попасть в
+    страницу, не читаются (и архивы не распаковываются).
+
+    Возвращает словарь:
+      rows — (id, student_id, full_name, action, location, timestamp),
+      has_more — есть ли еще записи за пределами этой страницы,
+      cursor — курсор следующей страницы (в режиме after_id — None),
+      last_id — наибольший id среди rows (или after_id, если rows пусто).
+    """
+    if order_by not in LOG_SORT_KEYS:
+        raise ValueError(f"Нельзя сортировать журнал по {order_by}")
+    since = _log_timestamp(since)
+    until = _log_timestamp(until)
+    conditions = []
+    params = []
+    for column, value in (('student_id', student_id), ('action', action), ('location', location)):
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        conditions.append("timestamp >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("timestamp < ?")
+        params.append(until)
+
+    if after_id is not None:
+        # Новые события — это страница по id от курсора after_id
+        order_by, descending, cursor = 'id', False, (after_id,)
+    keys = LOG_SORT_KEYS[order_by]
+
+    # Источники в порядке сортировки: первыми те, где могут быть лучшие ключи
+    sources = _log_sources(path, since, until)
+    first = 1 if descending else 0
+    bounded = [s for s in sources if s['bounds'].get(keys[0])]
+    bounded.sort(key=lambda s: s['bounds'][keys[0]][first], reverse=descending)
+    sources = [s for s in sources if not s['bounds'].get(keys[0])] + bounded
+
+    positions = [LOG_COLUMNS.index(key) for key in keys]
+    sort_key = lambda row: tuple(_sort_value(row[i]) for i in positions)
+    rows = []
+    has_more = False
+    for source in sources:
+        bounds = source['bounds'].get(keys[0])
+        if bounds is not None:
+            low, high = bounds
+            # Вся партиция за курсором — в ней нет строк следующей страницы
+            if cursor is not None and (low > cursor[0] if descending else high <= cursor[0]):
+                continue
+            # Страница уже набрана, а ключи партиции хуже последней строки
+            edge = rows[limit - 1][positions[0]] if len(rows) >= limit else None
+            if edge is not None and (high <= edge if descending else low > edge):
+                has_more = True
+                break
+        page = keyset_page(_source_connection(source),
+                           "SELECT id, student_id, full_name, action, location, timestamp FROM access_logs",
+                           conditions, params, keys, descending, cursor, limit)
+        rows = sorted(rows + page['rows'], key=sort_key, reverse=descending)
+        has_more = has_more or page['has_more']
+
+    has_more = has_more or len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more and after_id is None:
+        next_cursor = tuple(rows[-1][i] for i in positions)
+    return {
+        'rows': rows,
+        'has_more': has_more,
+        'cursor': next_cursor,
+        'last_id': max((row[0] for row in rows), default=after_id),
+    }
 
 def get_recent_logs(limit=100):
     """Получить последние логи"""
-    init_logs_db()
-    conn = sqlite3.connect(DB_LOGS)
+    return query_logs(limit=limit)['rows']
+
+# ==================== КТО СЕЙЧАС ВНУТРИ ====================
+
+# Столбцы строк, которые возвращает query_presence
+PRESENCE_COLUMNS = ('student_id', 'user_id', 'full_name', 'location', 'timestamp')
+
+# Сортировки списка находящихся внутри (student_id уникален)
+PRESENCE_SORT_KEYS = {
+    'timestamp': ('timestamp', 'student_id'),
+    'student_id': ('student_id',),
+    'location': ('location', 'timestamp', 'student_id'),
+}
+
+def _create_presence_schema(conn):
+    """Таблица presence: последнее событие каждого студента
+
+    Триггер обновляет ее в той же транзакции, что и вставку в access_logs,
+    поэтому она согласована с журналом при записи из любого процесса.
+    События, пришедшие с опозданием (старше уже учтенного), состояние
+    не меняют.
+    """
     cur = conn.cursor()
-    cur.execute("""SELECT id, student_id, full_name, action, location, timestamp 
-                  FROM access_logs ORDER BY timestamp DESC LIMIT ?""", (limit,))
-    logs = cur.fetchall()
-    conn.close()
-    return logs
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS presence (
+            student_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            full_name TEXT,
+            inside INTEGER NOT NULL,
+            location TEXT,
+            timestamp TIMESTAMP,
+            event_id INTEGER
+        )
+    """)
+    # Частичные индексы только по находящимся внутри: подсчет и список
+    # не зависят от того, сколько студентов когда-либо проходило
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_presence_inside_time 
+                  ON presence (timestamp, student_id) WHERE inside = 1""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS idx_presence_inside_location 
+                  ON presence (location, timestamp, student_id) WHERE inside = 1""")
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS presence_on_access AFTER INSERT ON access_logs
+        BEGIN
+            INSERT INTO presence (student_id, user_id, full_name, inside, location, timestamp, event_id)
+            VALUES (NEW.student_id, NEW.user_id, NEW.full_name, NEW.action = 'Вход',
+                    NEW.location, NEW.timestamp, NEW.id)
+            ON CONFLICT (student_id) DO UPDATE SET
+                user_id = excluded.user_id, full_name = excluded.full_name,
+                inside = excluded.inside, location = excluded.location,
+                timestamp = excluded.timestamp, event_id = excluded.event_id
+            WHERE excluded.timestamp >= presence.timestamp;
+        END
+    """)
+    conn.commit()
+
+def rebuild_presence(path=DB_LOGS):
+    """Пересобрать presence по журналу
+
+    Читаются основная база и неархивированные партиции (от новых к
+    старым): для каждого студента берется его последнее событие.
+    Архивы не распаковываются — присутствие не длится месяцами.
+    Возвращает число находящихся внутри.
+    """
+    latest = {}
+    conn = get_connection(path)
+    with conn:
+        # Чтение и запись — одна транзакция: пакет журнала, записанный
+        # другим процессом, ждет ее окончания и не затирается устаревшим состоянием
+        conn.execute("BEGIN IMMEDIATE")
+        sources = [source for source in _log_sources(path) if not source.get('archived')]
+        sources.sort(key=lambda source: source['month'] or '9999-99', reverse=True)
+        for source in sources:
+            source_conn = _source_connection(source)
+            # Последнее событие студента — по (timestamp, id), как и в триггере:
+            # MAX(timestamp) берется по индексу студента, среди событий с этим
+            # временем побеждает большее id (строки идут по возрастанию id)
+            cur = source_conn.execute("""SELECT a.student_id, a.user_id, a.full_name, a.action = 'Вход', 
+                                                a.location, a.timestamp, a.id 
+                                         FROM (SELECT student_id, MAX(timestamp) AS ts FROM access_logs 
+                                               WHERE student_id IS NOT NULL GROUP BY student_id) m 
+                                         JOIN access_logs a ON a.student_id = m.student_id AND a.timestamp = m.ts 
+                                         ORDER BY a.id""")
+            source_latest = {row[0]: row for row in cur}
+            for student_id, row in source_latest.items():
+                latest.setdefault(student_id, row)
+
+        conn.execute("DELETE FROM presence")
+        conn.executemany("""INSERT INTO presence (student_id, user_id, full_name, inside, location, timestamp, event_id) 
+                          VALUES (?, ?, ?, ?, ?, ?, ?)""", latest.values())
+    return sum(1 for row in latest.values() if row[3])
+
+def is_inside(student_id, path=DB_LOGS):
+    """Где находится студент: (location, timestamp входа) или None, если он снаружи"""
+    conn = get_connection(path)
+    return conn.execute("SELECT location, timestamp FROM presence WHERE student_id = ? AND inside = 1",
+                        (student_id,)).fetchone()
+
+def get_occupancy(path=DB_LOGS):
+    """Сколько людей внутри: {location: число} (по частичному индексу)"""
+    conn = get_connection(path)
+    return dict(conn.execute("SELECT location, COUNT(*) FROM presence WHERE inside = 1 GROUP BY location"))
+
+def query_presence(location=None, order_by='timestamp', descending=False, cursor=None,
+                   limit=100, path=DB_LOGS):
+    """Постраничный список находящихся внутри (для переклички при эвакуации)
+
+    Строки — (student_id, user_id, full_name, location, timestamp входа);
+    пагинация как у query_logs (см. keyset_page).
+    """
+    if order_by not in PRESENCE_SORT_KEYS:
+        raise ValueError(f"Нельзя сортировать список по {order_by}")
+    conditions = ["inside = 1"]
+    params = []
+    if location is not None:
+        conditions.append("location = ?")
+        params.append(location)
+    return keyset_page(get_connection(path),
+                       "SELECT student_id, user_id, full_name, location, timestamp FROM presence",
+                       conditions, params, PRESENCE_SORT_KEYS[order_by], descending, cursor, limit)
+
+# ==================== ДНЕВНЫЕ СВОДКИ ПОСЕЩАЕМОСТИ ====================
+
+# Сводки по дням (день — дата timestamp, то есть UTC) обновляются при
+# каждой записи журнала в той же транзакции:
+#   daily_student  — первый вход, последний выход, время внутри, число входов;
+#   daily_faculty  — входы и число разных студентов факультета;
+#   daily_location — входы и выходы по локациям.
+# Время визита целиком относится ко дню входа. Если события пришли не по
+# порядку, сводки пересчитываются rebuild_rollups.
+ROLLUP_TABLES = ('daily_student', 'daily_faculty', 'daily_location')
+
+# По сколько событий журнала обрабатывается при пересчете сводок
+ROLLUP_CHUNK = 50000
+
+# Факультет студентов, которых уже нет в базе пользователей
+UNKNOWN_FACULTY = ""
+
+def _create_rollup_schema(conn):
+    # WITHOUT ROWID: строки лежат в порядке (day, ключ), и отчет за период
+    # читает их подряд, без перехода от индекса к таблице
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_student (
+            day TEXT NOT NULL,
+            student_id TEXT NOT NULL,
+            first_entry TIMESTAMP,
+            last_exit TIMESTAMP,
+            seconds_inside REAL NOT NULL DEFAULT 0,
+            visits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, student_id)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_daily_student_student ON daily_student (student_id, day)")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_faculty (
+            day TEXT NOT NULL,
+            faculty TEXT NOT NULL,
+            visits INTEGER NOT NULL DEFAULT 0,
+            students INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, faculty)
+        ) WITHOUT ROWID
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS daily_location (
+            day TEXT NOT NULL,
+            location TEXT NOT NULL,
+            entries INTEGER NOT NULL DEFAULT 0,
+            exits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, location)
+        ) WITHOUT ROWID
+    """)
+    conn.commit()
+
+def _student_faculties(student_ids):
+    """Факультеты студентов из базы пользователей: {student_id: faculty}"""
+    student_ids = [sid for sid in student_ids if sid is not None]
+    if not student_ids:
+        return {}
+    conn = get_connection(DB_USERS)
+    return dict(conn.execute(f"""SELECT student_id, faculty FROM users 
+                               WHERE student_id IN ({', '.join('?' * len(student_ids))})""",
+                             student_ids))
+
+def _open_visits(conn, student_ids):
+    """Время входа находящихся внутри студентов из presence: {student_id: timestamp}"""
+    student_ids = [sid for sid in student_ids if sid is not None]
+    if not student_ids:
+        return {}
+    return dict(conn.execute(f"""SELECT student_id, timestamp FROM presence 
+                               WHERE inside = 1 AND student_id IN ({', '.join('?' * len(student_ids))})""",
+                             student_ids))
+
+def _seconds_between(start, end):
+    return (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds()
+
+def _apply_rollups(conn, events, open_visits, faculties):
+    """Добавить события журнала к дневным сводкам (внутри транзакции conn)
+
+    events — строки, начинающиеся с (user_id, student_id, full_name,
+    action, location, timestamp), в порядке времени. open_visits —
+    {student_id: timestamp входа}, обновляется по ходу обработки.
+    """
+    # Сначала события сворачиваются в приращения по ключам сводок
+    students = {}   # (day, student_id) -> [first_entry, last_exit, seconds, visits]
+    locations = {}  # (day, location) -> [entries, exits]
+    for row in events:
+        _, student_id, _, action, location, timestamp = row[:6]
+        if student_id is None or timestamp is None:
+            continue
+        day = timestamp[:10]
+        entered = action == "Вход"
+        locations.setdefault((day, location or ""), [0, 0])[0 if entered else 1] += 1
+        stats = students.setdefault((day, student_id), [None, None, 0.0, 0])
+        if entered:
+            stats[0] = min(stats[0] or timestamp, timestamp)
+            stats[3] += 1
+            # Повторный вход без выхода начинает визит заново (как в presence):
+            # время после пропущенного выхода неизвестно и не учитывается
+            open_visits[student_id] = timestamp
+        else:
+            stats[1] = max(stats[1] or timestamp, timestamp)
+            start = open_visits.pop(student_id, None)
+            if start is not None and start <= timestamp:
+                visit = students.setdefault((start[:10], student_id), [None, None, 0.0, 0])
+                visit[2] += _seconds_between(start, timestamp)
+
+    # Студент учитывается в daily_faculty.students при первом входе за день
+    faculty_stats = {}  # (day, faculty) -> [visits, new students]
+    for day in {day for day, _ in students}:
+        seen = {row[0] for row in conn.execute(
+            "SELECT student_id FROM daily_student WHERE day = ? AND visits > 0", (day,))}
+        for (stats_day, student_id), stats in students.items():
+            if stats_day != day or not stats[3]:
+                continue
+            key = (day, faculties.get(student_id, UNKNOWN_FACULTY))
+            counts = faculty_stats.setdefault(key, [0, 0])
+            counts[0] += stats[3]
+            counts[1] += student_id not in seen
+
+    conn.executemany("""INSERT INTO daily_student (day, student_id, first_entry, last_exit, seconds_inside, visits) 
+                      VALUES (?, ?, ?, ?, ?, ?) 
+                      ON CONFLICT (day, student_id) DO UPDATE SET 
+                          first_entry = COALESCE(MIN(first_entry, excluded.first_entry), first_entry, excluded.first_entry), 
+                          last_exit = COALESCE(MAX(last_exit, excluded.last_exit), last_exit, excluded.last_exit), 
+                          seconds_inside = seconds_inside + excluded.seconds_inside, 
+                          visits = visits + excluded.visits""",
+                     [key + tuple(stats) for key, stats in students.items()])
+    conn.executemany("""INSERT INTO daily_faculty (day, faculty, visits, students) VALUES (?, ?, ?, ?) 
+                      ON CONFLICT (day, faculty) DO UPDATE SET 
+                          visits = visits + excluded.visits, students = students + excluded.students""",
+                     [key + tuple(counts) for key, counts in faculty_stats.items()])
+    conn.executemany("""INSERT INTO daily_location (day, location, entries, exits) VALUES (?, ?, ?, ?) 
+                      ON CONFLICT (day, location) DO UPDATE SET 
+                          entries = entries + excluded.entries, exits = exits + excluded.exits""",
+                     [key + tuple(counts) for key, counts in locations.items()])
+
+def rebuild_rollups(faculties=None, path=DB_LOGS):
+    """Пересчитать дневные сводки по всему журналу за один потоковый проход
+
+    События читаются из партиций (включая архивы) и основной базы по
+    порядку времени страницами по ROLLUP_CHUNK, так что память не
+    зависит от размера журнала. faculties — {student_id: faculty}, по
+    умолчанию из базы пользователей. Возвращает число событий.
+    """
+    if faculties is None:
+        faculties = dict(get_connection(DB_USERS).execute("SELECT student_id, faculty FROM users"))
+    sources = sorted(_log_sources(path), key=lambda source: source['month'] or '9999-99')
+    open_visits = {}
+    count = 0
+    conn = get_connection(path)
+    with conn:
+        # Пересборка — одна транзакция: запись журнала ждет ее окончания,
+        # поэтому ни одно событие не учитывается дважды
+        conn.execute("BEGIN IMMEDIATE")
+        for table in ROLLUP_TABLES:
+            conn.execute(f"DELETE FROM {table}")
+        for source in sources:
+            source_conn = _source_connection(source)
+            cursor = None
+            while True:
+                page = keyset_page(source_conn,
+                                   "SELECT user_id, student_id, full_name, action, location, timestamp, id FROM access_logs",
+                                   [], [], ('timestamp', 'id'), False, cursor, ROLLUP_CHUNK)
+                _apply_rollups(conn, page['rows'], open_visits, faculties)
+                count += len(page['rows'])
+                if not page['has_more']:
+                    break
+                cursor = page['cursor']
+    return count
+
+def _rollup_query(table, columns, key_column, key, since, until, path):
+    conditions = []
+    params = []
+    if key is not None:
+        conditions.append(f"{key_column} = ?")
+        params.append(key)
+    if since is not None:
+        conditions.append("day >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("day < ?")
+        params.append(until)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = get_connection(path)
+    return conn.execute(f"SELECT {columns} FROM {table}{where} ORDER BY day, {key_column}", params).fetchall()
+
+def get_student_attendance(student_id=None, since=None, until=None, path=DB_LOGS):
+    """Посещаемость по дням [since, until) ('YYYY-MM-DD')
+
+    Строки — (day, student_id, first_entry, last_exit, seconds_inside, visits).
+    """
+    return _rollup_query('daily_student', "day, student_id, first_entry, last_exit, seconds_inside, visits",
+                         'student_id', student_id, since, until, path)
+
+def get_faculty_attendance(faculty=None, since=None, until=None, path=DB_LOGS):
+    """Входы и число студентов факультетов по дням: (day, faculty, visits, students)"""
+    return _rollup_query('daily_faculty', "day, faculty, visits, students",
+                         'faculty', faculty, since, until, path)
+
+def get_location_attendance(location=None, since=None, until=None, path=DB_LOGS):
+    """Входы и выходы по локациям и дням: (day, location, entries, exits)"""
+    return _rollup_query('daily_location', "day, location, entries, exits",
+                         'location', location, since, until, path)
+
+def get_attendance_report(since=None, until=None, path=DB_LOGS):
+    """Итоги посещаемости за период [since, until) по студентам
+
+    Строки — (student_id, дней с посещениями, входов, секунд внутри,
+    первый вход, последний выход) по сводке daily_student.
+    """
+    conditions = ["visits > 0"]
+    params = []
+    if since is not None:
+        conditions.append("day >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("day < ?")
+        params.append(until)
+    conn = get_connection(path)
+    return conn.execute(f"""SELECT student_id, COUNT(*), SUM(visits), SUM(seconds_inside), 
+                                  MIN(first_entry), MAX(last_exit) 
+                           FROM daily_student WHERE {' AND '.join(conditions)} 
+                           GROUP BY student_id ORDER BY student_id""", params).fetchall()
 
-# Инициализация баз данных при импорте
+# Инициализация баз данных при импорте (схема создается один раз на процесс)
 init_db()
-init_logs_db()
\ No newline at end of file
+init_logs_db()
+# presence появилась в уже заполненном журнале — собираем ее один раз,
+# дальше ее ведет триггер
+if get_last_log_id() and not get_connection(DB_LOGS).execute("SELECT 1 FROM presence LIMIT 1").fetchone():
+    rebuild_presence()
+# Сводки появились в уже заполненном журнале — считаем их один раз
+if get_last_log_id() and not get_connection(DB_LOGS).execute("SELECT 1 FROM daily_location LIMIT 1").fetchone():
+    rebuild_rollups()
+migrate_face_encodings()
+migrate_face_templates()
\ No newline at end of file
@@ -0,0 +1,276 @@
+import threading
+
+import numpy as np
+
+from ann_index import ANN_INDEX_PATH, ANN_MIN_GALLERY_SIZE, load_or_build_index
+
+# Порог распознавания (евклидово расстояние между дескрипторами dlib)
+MATCH_THRESHOLD = 0.6
+DESCRIPTOR_SIZE = 128
+
+
+class TextColumn:
+    """Столбец строк переменной длины: смещения (N+1) и общий буфер UTF-8
+
+    Так строки хранятся в снимке галереи: оба массива отображаются в память,
+    строка декодируется только при обращении к ней. Длина строк не
+    ограничена, многобайтовые символы не обрезаются.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, values):
+        encoded = [str(value).encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        return cls(offsets, np.frombuffer(b"".join(encoded), dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __array__(self, dtype=None, copy=None):
+        # Первое изменение галереи копирует столбец в обычный массив строк
+        return np.array(list(self), dtype=object if dtype is None else dtype)
+
+
+def _text_column(values):
+    return values if isinstance(values, TextColumn) else np.asarray(values)
+
+
+class FaceGallery:
+    """Галерея известных лиц: все encodings в одной непрерывной float32 матрице
+
+    Строка i матрицы encodings — один шаблон лица пользователя user_ids[i]
+    (student_ids[i], names[i]). У пользователя может быть несколько
+    шаблонов; строки одного пользователя всегда идут подряд. Поиск
+    выполняется одной матричной операцией для всех дескрипторов кадра, а
+    минимум по шаблонам каждого пользователя — одной сегментной редукцией.
+    """
+
+    def __init__(self, encodings=None, student_ids=(), user_ids=(), names=(), sq_norms=None):
+        if encodings is None:
+            encodings = np.empty((0, DESCRIPTOR_SIZE), dtype=np.float32)
+        # Массивы (в т.ч. np.memmap снимка галереи) используются без копирования
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, DESCRIPTOR_SIZE)
+        self.student_ids = _text_column(student_ids)
+        self.user_ids = np.asarray(user_ids, dtype=np.int64)
+        self.names = _text_column(names)
+        # Квадраты норм считаются один раз при построении галереи
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', self.encodings, self.encodings)
+        self.sq_norms = sq_norms
+        # Необязательный ANN-индекс (см. enable_ann)
+        self.index = None
+        # Номер ленты изменений базы, которому соответствует галерея (если
+        # известен), и идентификатор этой базы
+        self.version = None
+        self.db_id = None
+        # Собственные буферы с запасом емкости появляются при первом изменении
+        # (массивы снимка в памяти доступны только для чтения)
+        self._buffers = None
+        self._starts = None
+        # Изменения применяет поток распознавания, искать могут и другие потоки
+        # (проверка на повтор при регистрации): массивы сдвигаются на месте,
+        # поэтому изменение и поиск не должны идти одновременно
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.encodings)
+
+    def identity_starts(self):
+        """Номера первых строк каждого пользователя (границы сегментов шаблонов)"""
+        with self._lock:
+            if self._starts is None:
+                user_ids = self.user_ids
+                boundaries = np.flatnonzero(user_ids[1:] != user_ids[:-1]) + 1
+                self._starts = np.concatenate(([0], boundaries)) if len(user_ids) else boundaries
+            return self._starts
+
+    def identity_count(self):
+        """Количество пользователей в галерее (строк может быть больше — по шаблону на строку)"""
+        return len(self.identity_starts())
+
+    def enable_ann(self, path=ANN_INDEX_PATH, min_size=ANN_MIN_GALLERY_SIZE, nprobe=None):
+        """Включить приближенный поиск (IVF) для больших галерей
+
+        Маленькие галереи продолжают перебираться целиком. Индекс
+        сохраняется на диск и переиспользуется при следующем запуске.
+        """
+        with self._lock:
+            if len(self) < min_size:
+                self.index = None
+                return False
+            # Для галереи из снимка отпечатком служат база и номер ее ленты —
+            # без хеширования всей матрицы (номер seq новой базы начинается заново)
+            fingerprint = f"{self.db_id}:seq{self.version}" if self.version is not None else None
+            self.index = load_or_build_index(self.encodings, self.student_ids, path,
+                                             nprobe=nprobe, fingerprint=fingerprint)
+            return True
+
+    # ==================== ИНКРЕМЕНТАЛЬНЫЕ ИЗМЕНЕНИЯ ====================
+
+    def _reserve(self, size):
+        """Перенос данных в собственные буферы с запасом емкости"""
+        if self._buffers is not None and len(self._buffers['encodings']) >= size:
+            return
+        n = len(self)
+        capacity = max(size, int(n * 1.5), 64)
+        buffers = {
+            'encodings': np.empty((capacity, DESCRIPTOR_SIZE), dtype=np.float32),
+            'sq_norms': np.empty(capacity, dtype=np.float32),
+            'user_ids': np.empty(capacity, dtype=np.int64),
+            'student_ids': np.empty(capacity, dtype=object),
+            'names': np.empty(capacity, dtype=object),
+        }
+        for key, buf in buffers.items():
+            buf[:n] = getattr(self, key)
+        self._buffers = buffers
+
+    def _set_size(self, n):
+        for key, buf in self._buffers.items():
+            setattr(self, key, buf[:n])
+        self._starts = None
+
+    def upsert(self, encodings, student_ids, user_ids, names):
+        """Добавить новых пользователей или заменить все шаблоны существующих
+
+        Строки — шаблоны; все шаблоны пользователя передаются вместе.
+        Пользователи дописываются в конец галереи, их строки идут подряд.
+        """
+        with self._lock:
+            encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, DESCRIPTOR_SIZE)
+            if len(encodings) == 0:
+                return
+            user_ids = np.asarray(user_ids, dtype=np.int64)
+            self.remove(np.unique(user_ids))
+            # Шаблоны одного пользователя должны идти подряд
+            order = np.argsort(user_ids, kind='stable')
+            n = len(self)
+            self._reserve(n + len(order))
+            buf = self._buffers
+            rows = slice(n, n + len(order))
+            buf['encodings'][rows] = encodings[order]
+            buf['sq_norms'][rows] = np.einsum('ij,ij->i', encodings[order], encodings[order])
+            buf['user_ids'][rows] = user_ids[order]
+            buf['student_ids'][rows] = np.asarray(student_ids, dtype=object)[order]
+            buf['names'][rows] = np.asarray(names, dtype=object)[order]
+            self._set_size(n + len(order))
+
+            if self.index is not None:
+                labels = np.concatenate((self.index.labels[:n], self.index.label(self.encodings[rows])))
+                self.index.set_labels(labels)
+
+    def remove(self, user_ids):
+        """Удалить пользователей (все их шаблоны) по user_id
+
+        Оставшиеся строки сдвигаются к началу с сохранением порядка, поэтому
+        шаблоны каждого пользователя по-прежнему идут подряд.
+        """
+        with self._lock:
+            n = len(self)
+            removed = np.isin(self.user_ids, np.asarray(list(user_ids), dtype=np.int64))
+            if not removed.any():
+                return
+            keep = ~removed
+            self._reserve(n)
+            buf = self._buffers
+            kept = int(keep.sum())
+            for key in buf:
+                buf[key][:kept] = buf[key][:n][keep]
+            self._set_size(kept)
+
+            if self.index is not None:
+                self.index.set_labels(self.index.labels[:n][keep])
+
+    def apply_changes(self, changes):
+        """Применить изменения из database.get_user_changes()"""
+        with self._lock:
+            self.remove(changes['removed'])
+            self.upsert(*changes['rows'])
+            self.version = changes['seq']
+
+    # ==================== ПОИСК ====================
+
+    def distances(self, descriptors, rows=None):
+        """Матрица расстояний (N x M) от N дескрипторов до M лиц галереи
+
+        rows ограничивает сравнение подмножеством строк галереи.
+        """
+        queries = np.asarray(descriptors, dtype=np.float32).reshape(-1, DESCRIPTOR_SIZE)
+        encodings, sq_norms = self.encodings, self.sq_norms
+        if rows is not None:
+            encodings, sq_norms = encodings[rows], sq_norms[rows]
+        # |q - g|^2 = |q|^2 + |g|^2 - 2 q·g
+        sq = (np.einsum('ij,ij->i', queries, queries)[:, None]
+              + sq_norms[None, :]
+              - 2.0 * queries @ encodings.T)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+    def identity_distances(self, descriptors):
+        """Расстояния (N x U) от N дескрипторов до U пользователей галереи
+
+        Расстояние до пользователя — минимум по всем его шаблонам; минимумы
+        считаются одной операцией np.minimum.reduceat по сегментам строк.
+        """
+        return np.minimum.reduceat(self.distances(descriptors), self.identity_starts(), axis=1)
+
+    def nearest(self, descriptors):
+        """Ближайший пользователь галереи для каждого дескриптора
+
+        Возвращает номера строк (первый шаблон пользователя) и расстояния
+        до ближайшего из его шаблонов. Для пустой галереи — индексы -1 и
+        расстояния inf.
+        """
+        with self._lock:
+            queries = np.asarray(descriptors, dtype=np.float32).reshape(-1, DESCRIPTOR_SIZE)
+            if len(self) == 0:
+                return (np.full(len(queries), -1, dtype=np.int64),
+                        np.full(len(queries), np.inf, dtype=np.float32))
+            if self.index is not None:
+                return self._nearest_ann(queries)
+            dist = self.identity_distances(queries)
+            best = np.argmin(dist, axis=1)
+            return self.identity_starts()[best], dist[np.arange(len(queries)), best]
+
+    def _nearest_ann(self, queries):
+        # Кандидаты из индекса переранжируются по точным расстояниям,
+        # поэтому решение по порогу остается тем же, что и при полном переборе
+        idx = np.empty(len(queries), dtype=np.int64)
+        dist = np.empty(len(queries), dtype=np.float32)
+        for i, query in enumerate(queries):
+            rows = self.index.candidates(query)
+            if len(rows) == 0:
+                rows = np.arange(len(self))
+            # Ближайший шаблон среди кандидатов принадлежит ближайшему
+            # пользователю — отдельная редукция по пользователям не нужна
+            d = self.distances(query, rows)[0]
+            j = np.argmin(d)
+            idx[i], dist[i] = rows[j], d[j]
+        return idx, dist
+
+    def match(self, descriptors, threshold=MATCH_THRESHOLD):
+        """Распознавание одного или нескольких дескрипторов за одну операцию
+
+        Возвращает список (user_id, student_id, name, distance) для каждого
+        дескриптора либо None, если ближайшее лицо дальше порога.
+        """
+        with self._lock:
+            idx, dist = self.nearest(descriptors)
+            results = []
+            for i, d in zip(idx, dist):
+                if i >= 0 and d < threshold:
+                    results.append((int(self.user_ids[i]), str(self.student_ids[i]),
+                                    str(self.names[i]), float(d)))
+                else:
+                    results.append(None)
+            return results
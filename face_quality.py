@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+
+# Пороги качества лица для распознавания
+MIN_FACE_SIZE = 60        # меньшая сторона рамки в пикселях полного кадра
+MIN_SHARPNESS = 40.0      # дисперсия лапласиана лица, приведенного к QUALITY_CROP_SIZE
+MAX_YAW = 35.0            # поворот головы влево-вправо, градусы
+MAX_PITCH = 25.0          # наклон головы вверх-вниз, градусы
+
+# Для регистрации снимок должен быть заметно лучше, чем для распознавания
+ENROLL_THRESHOLDS = {'min_size': 100, 'min_sharpness': 80.0, 'max_yaw': 15.0, 'max_pitch': 15.0}
+
+# Лицо приводится к одному размеру, чтобы резкость не зависела от расстояния
+QUALITY_CROP_SIZE = 96
+
+# Точки усредненной 3D-модели головы (мм) и их номера среди 68 landmarks dlib.
+# Оси как у камеры: x вправо, y вниз, z от камеры — у фронтального лица поворот нулевой
+MODEL_POINTS = np.array([
+    (0.0, 0.0, 0.0),          # 30: кончик носа
+    (0.0, 330.0, 65.0),       # 8: подбородок
+    (-225.0, -170.0, 135.0),  # 36: внешний угол левого (в кадре) глаза
+    (225.0, -170.0, 135.0),   # 45: внешний угол правого глаза
+    (-150.0, 150.0, 125.0),   # 48: левый угол рта
+    (150.0, 150.0, 125.0),    # 54: правый угол рта
+])
+LANDMARK_INDICES = (30, 8, 36, 45, 48, 54)
+
+# Подсказки оператору по самому слабому показателю
+QUALITY_HINTS = {
+    'size': "лицо слишком далеко от камеры",
+    'sharpness': "изображение смазано",
+    'yaw': "лицо повернуто в сторону",
+    'pitch': "голова наклонена",
+}
+
+
+def head_pose(shape, frame_size):
+    """Поворот головы (yaw, pitch, roll) в градусах по 68 landmarks (solvePnP)
+
+    Камера приближенно откалибрована: фокусное расстояние равно ширине
+    кадра, оптический центр — в центре кадра.
+    """
+    h, w = frame_size
+    image_points = np.array([(shape.part(i).x, shape.part(i).y) for i in LANDMARK_INDICES],
+                            dtype=np.float64)
+    camera = np.array([[w, 0, w / 2], [0, w, h / 2], [0, 0, 1]], dtype=np.float64)
+    # Начальное приближение — фронтальное лицо на расстоянии, оцененном по
+    # расстоянию между глазами; без него решение иногда «переворачивается»
+    eyes = max(np.linalg.norm(image_points[3] - image_points[2]), 1.0)
+    nose = image_points[0]
+    distance = w * (MODEL_POINTS[3][0] - MODEL_POINTS[2][0]) / eyes
+    tvec = np.array([[(nose[0] - w / 2) * distance / w], [(nose[1] - h / 2) * distance / w],
+                     [distance]])
+    ok, rvec, _ = cv2.solvePnP(MODEL_POINTS, image_points, camera, np.zeros(4),
+                               np.zeros((3, 1)), tvec, useExtrinsicGuess=True)
+    if not ok:
+        return None
+    rotation, _ = cv2.Rodrigues(rvec)
+    pitch, yaw, roll = cv2.RQDecomp3x3(rotation)[0]
+    return yaw, pitch, roll
+
+
+def sharpness(gray, box):
+    """Дисперсия лапласиана области лица, приведенной к QUALITY_CROP_SIZE"""
+    left, top, right, bottom = box
+    h, w = gray.shape[:2]
+    crop = gray[max(top, 0):min(bottom, h), max(left, 0):min(right, w)]
+    if crop.size == 0:
+        return 0.0
+    crop = cv2.resize(crop, (QUALITY_CROP_SIZE, QUALITY_CROP_SIZE), interpolation=cv2.INTER_AREA)
+    return float(cv2.Laplacian(crop, cv2.CV_64F).var())
+
+
+class FaceQuality:
+    """Оценка качества лица перед вычислением дескриптора
+
+    Учитываются размер рамки, резкость (дисперсия лапласиана) и поворот
+    головы по landmarks. Каждый показатель делится на свой порог (для
+    углов — порог на угол), итоговая оценка score — наименьшее из этих
+    отношений (не больше 2): лицо годится при score >= 1.
+    """
+
+    def __init__(self, min_size=MIN_FACE_SIZE, min_sharpness=MIN_SHARPNESS,
+                 max_yaw=MAX_YAW, max_pitch=MAX_PITCH):
+        self.min_size = min_size
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.max_pitch = max_pitch
+
+    @classmethod
+    def for_enrollment(cls):
+        """Оценка с более строгими порогами регистрации (ENROLL_THRESHOLDS)"""
+        return cls(**ENROLL_THRESHOLDS)
+
+    def large_enough(self, box):
+        """Быстрая проверка размера — до вычисления landmarks"""
+        left, top, right, bottom = box
+        return min(right - left, bottom - top) >= self.min_size
+
+    def assess(self, gray, box, shape):
+        """Оценка лица: словарь с показателями, score, ok и reason (худший показатель)"""
+        left, top, right, bottom = box
+        quality = {'size': min(right - left, bottom - top), 'sharpness': sharpness(gray, box)}
+        pose = head_pose(shape, gray.shape[:2])
+        quality['yaw'], quality['pitch'], quality['roll'] = pose if pose else (90.0, 90.0, 0.0)
+
+        ratios = {
+            'size': quality['size'] / self.min_size,
+            'sharpness': quality['sharpness'] / self.min_sharpness,
+            'yaw': self.max_yaw / max(abs(quality['yaw']), 1e-6),
+            'pitch': self.max_pitch / max(abs(quality['pitch']), 1e-6),
+        }
+        reason = min(ratios, key=ratios.get)
+        quality['score'] = round(min(ratios[reason], 2.0), 3)
+        quality['ok'] = quality['score'] >= 1.0
+        quality['reason'] = None if quality['ok'] else reason
+        return quality
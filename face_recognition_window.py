@@ -1,14 +1,23 @@
-import cv2
-import dlib
-import numpy as np
 from datetime import datetime
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
                              QPushButton, QMessageBox, QDialog, QLineEdit, 
-                             QComboBox, QFormLayout)
-from PyQt5.QtGui import QImage, QPixmap, QFont
-from PyQt5.QtCore import QTimer, Qt
-from database import (load_all_encodings, save_face_encoding, log_access, 
-                     get_user_by_student_id)
+                             QComboBox, QFormLayout, QProgressBar)
+from PyQt5.QtGui import QFont
+from PyQt5.QtCore import Qt, QTimer
+from database import save_face_templates
+from log_writer import get_log_writer
+from face_quality import QUALITY_HINTS
+from motion_gate import MotionGate
+from recognition_engine import ENROLL_MIN_TEMPLATES, RecognitionEngine, draw_faces
+from video_pipeline import (CaptureThread, EngineLoader, EnrollmentWorker, FrameRenderer,
+                            InferenceWorker)
+
+# Номер камеры режима распознавания
+CAMERA_INDEX = 0
+
+# Регистрация: серия кадров, из которой выбираются шаблоны лица
+ENROLL_BURST_FRAMES = 15
+ENROLL_BURST_INTERVAL = 100  # мс между кадрами серии
 
 
 class RegisterDialog(QDialog):
@@ -99,24 +108,60 @@ class RegisterDialog(QDialog):
 class FaceRecognitionWindow(QWidget):
     """Окно системы распознавания лиц"""
     
-    def __init__(self):
+    def __init__(self, camera_index=CAMERA_INDEX):
         super().__init__()
         
-        # Загрузка dlib моделей
-        try:
-            self.detector = dlib.get_frontal_face_detector()
-            self.sp = dlib.shape_predictor("dat/shape_predictor_68_face_landmarks.dat")
-            self.facerec = dlib.face_recognition_model_v1("dat/dlib_face_recognition_resnet_model_v1.dat")
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить модели dlib:\n{e}")
-            return
+        self.camera_index = camera_index
+        self.engine = None
+        self.capture = None
+        self.worker = None
+        # Режим распознавания открыт (камера нужна, как только загрузятся модели)
+        self.active = False
+        self.current_recognized = None
+        self.renderer = FrameRenderer()
+        # Кадры серии регистрации (None — регистрация не идет)
+        self.enroll_frames = None
+        self.enroll_seq = 0
+        self.enroll_ticks = 0
+        # Поток обработки серии (None — серия не обрабатывается)
+        self.enroller = None
+        self.enroll_timer = QTimer(self)
+        self.enroll_timer.setInterval(ENROLL_BURST_INTERVAL)
+        self.enroll_timer.timeout.connect(self.capture_enroll_frame)
         
         self.init_ui()
-        self.init_camera()
-        
-        # Загружаем пользователей с encodings
-        self.known_users = load_all_encodings()
-        self.current_recognized = None
+        self.load_engine()
+    
+    def load_engine(self):
+        """Загрузка dlib моделей и галереи известных лиц в фоновом потоке"""
+        # Пороги детектора движения задаются для каждой камеры (motion_gate.CAMERA_MOTION_SETTINGS)
+        self.loader = EngineLoader(lambda: RecognitionEngine(
+            motion_gate=MotionGate.for_camera(self.camera_index)))
+        self.loader.loaded.connect(self.on_engine_loaded)
+        self.loader.failed.connect(self.on_engine_failed)
+        self.loader.start()
+    
+    def on_engine_loaded(self, engine):
+        self.engine = engine
+        self.loading_bar.hide()
+        self.register_btn.setEnabled(True)
+        self.set_status("⏳ Ожидание распознавания...", "#fff3cd", "#856404")
+        if self.active:
+            self.start()
+    
+    def on_engine_failed(self, error):
+        self.loading_bar.hide()
+        self.set_status("❌ Модели не загружены", "#f8d7da", "#721c24")
+        QMessageBox.critical(self, "Ошибка", f"Не удалось загрузить модели dlib:\n{error}")
+    
+    def sync_gallery(self):
+        """Применить изменения базы пользователей (добавления, удаления) к галерее"""
+        if self.engine is not None:
+            self.engine.request_sync()
+    
+    def set_status(self, text, background, color):
+        self.status_label.setText(text)
+        self.status_label.setStyleSheet(f"padding: 15px; background-color: {background}; color: {color}; font-weight: bold; font-size: 14px;")
     
     def init_ui(self):
         """Инициализация интерфейса"""
@@ -141,8 +186,21 @@ class FaceRecognitionWindow(QWidget):
         self.video_label.setAlignment(Qt.AlignCenter)
         layout.addWidget(self.video_label)
         
+        # Индикатор загрузки моделей (без процента — длительность неизвестна)
+        self.loading_bar = QProgressBar()
+        self.loading_bar.setRange(0, 0)
+        self.loading_bar.setTextVisible(False)
+        self.loading_bar.setMaximumHeight(8)
+        layout.addWidget(self.loading_bar)
+        
+        # Измеренная частота захвата и распознавания
+        self.fps_label = QLabel("📷 Камера: — FPS | 🧠 Распознавание: — FPS")
+        self.fps_label.setAlignment(Qt.AlignRight)
+        self.fps_label.setStyleSheet("padding: 4px 10px; color: #666666; font-size: 12px;")
+        layout.addWidget(self.fps_label)
+        
         # Статус
-        self.status_label = QLabel("⏳ Ожидание распознавания...")
+        self.status_label = QLabel("⏳ Загрузка моделей распознавания...")
         self.status_label.setAlignment(Qt.AlignCenter)
         status_font = QFont()
         status_font.setPointSize(12)
@@ -154,9 +212,11 @@ class FaceRecognitionWindow(QWidget):
         # Кнопки управления
         buttons_layout = QHBoxLayout()
         
-        register_btn = QPushButton("➕ ЗАРЕГИСТРИРОВАТЬ НОВОЕ ЛИЦО")
-        register_btn.setStyleSheet("background-color: #4CAF50; color: white; padding: 12px; font-size: 14px; font-weight: bold;")
-        register_btn.clicked.connect(self.register_new_face)
+        # Регистрация доступна после загрузки моделей
+        self.register_btn = QPushButton("➕ ЗАРЕГИСТРИРОВАТЬ НОВОЕ ЛИЦО")
+        self.register_btn.setStyleSheet("background-color: #4CAF50; color: white; padding: 12px; font-size: 14px; font-weight: bold;")
+        self.register_btn.clicked.connect(self.register_new_face)
+        self.register_btn.setEnabled(False)
         
         entry_btn = QPushButton("🟢 ВХОД")
         entry_btn.setStyleSheet("background-color: #2196F3; color: white; padding: 12px; font-size: 14px; font-weight: bold;")
@@ -166,102 +226,191 @@ class FaceRecognitionWindow(QWidget):
         exit_btn.setStyleSheet("background-color: #FF9800; color: white; padding: 12px; font-size: 14px; font-weight: bold;")
         exit_btn.clicked.connect(lambda: self.log_access_event("Выход"))
         
-        buttons_layout.addWidget(register_btn)
+        buttons_layout.addWidget(self.register_btn)
         buttons_layout.addWidget(entry_btn)
         buttons_layout.addWidget(exit_btn)
         
         layout.addLayout(buttons_layout)
         self.setLayout(layout)
     
-    def init_camera(self):
-        """Инициализация камеры и таймера"""
-        self.cap = cv2.VideoCapture(0)
-        if not self.cap.isOpened():
-            QMessageBox.warning(self, "Ошибка", "Не удалось открыть камеру!")
+    def start(self):
+        """Вход в режим распознавания: открыть камеру и запустить потоки
+        
+        Если модели еще загружаются, камера откроется по их готовности.
+        """
+        self.active = True
+        if self.engine is None or self.worker is not None:
             return
         
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_frame)
-        self.timer.start(30)
-    
-    def update_frame(self):
-        """Обновление кадра с камеры и распознавание лиц"""
-        if not self.cap.isOpened():
+        capture = CaptureThread(self.camera_index)
+        if not capture.is_opened():
+            capture.release()
+            QMessageBox.warning(self, "Ошибка", "Не удалось открыть камеру!")
             return
         
-        ret, frame = self.cap.read()
-        if not ret:
+        self.engine.reset()
+        self.capture = capture
+        self.worker = InferenceWorker(self.capture, self.engine)
+        self.worker.results_ready.connect(self.update_frame)
+        self.capture.start()
+        self.worker.start()
+    
+    def stop(self):
+        """Выход из режима распознавания: остановить потоки и освободить камеру"""
+        self.active = False
+        self.cancel_enrollment()
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+        self.current_recognized = None
+        self.video_label.clear()
+    
+    def update_frame(self, result):
+        """Отрисовка результатов распознавания очередного кадра"""
+        # Результат, отправленный до остановки камеры
+        if self.worker is None:
             return
         
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        dets = self.detector(gray)
+        faces = result['faces']
         
         self.current_recognized = None
         
-        for d in dets:
-            shape = self.sp(gray, d)
-            face_descriptor = np.array(self.facerec.compute_face_descriptor(frame, shape))
-            
-            # Поиск ближайшего совпадения
-            best_match = None
-            best_distance = float('inf')
-            
-            for student_id, user_data in self.known_users.items():
-                distance = np.linalg.norm(face_descriptor - np.array(user_data['encoding']))
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match = (student_id, user_data['name'], user_data['id'])
-            
-            # Порог распознавания
-            if best_match and best_distance < 0.6:
-                student_id, name, user_id = best_match
+        # Во время съемки и обработки серии в строке статуса — ее ход
+        show_status = self.enroll_frames is None and self.enroller is None
+        
+        for _, match in faces:
+            if match:
+                user_id, student_id, name, _ = match
                 self.current_recognized = (user_id, student_id, name)
-                color = (0, 255, 0)  # Зеленый
-                label = f"{name} (ID: {student_id})"
-                self.status_label.setText(f"✅ РАСПОЗНАН: {name} | ID: {student_id}")
-                self.status_label.setStyleSheet("padding: 15px; background-color: #d4edda; color: #155724; font-weight: bold; font-size: 14px;")
-            else:
-                color = (0, 0, 255)  # Красный
-                label = "НЕИЗВЕСТЕН"
+                if show_status:
+                    self.status_label.setText(f"✅ РАСПОЗНАН: {name} | ID: {student_id}")
+                    self.status_label.setStyleSheet("padding: 15px; background-color: #d4edda; color: #155724; font-weight: bold; font-size: 14px;")
+            elif show_status:
                 self.status_label.setText("❌ Лицо не распознано | Доступ запрещен")
                 self.status_label.setStyleSheet("padding: 15px; background-color: #f8d7da; color: #721c24; font-weight: bold; font-size: 14px;")
-            
-            # Рисуем рамку и текст
-            cv2.rectangle(frame, (d.left(), d.top()), (d.right(), d.bottom()), color, 3)
-            cv2.putText(frame, label, (d.left(), max(d.top() - 10, 0)),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
         
-        if len(dets) == 0:
+        if len(faces) == 0 and show_status:
             self.status_label.setText("⏳ Ожидание распознавания...")
             self.status_label.setStyleSheet("padding: 15px; background-color: #fff3cd; color: #856404; font-weight: bold; font-size: 14px;")
         
-        # Конвертируем для PyQt
-        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = rgb.shape
-        bytes_per_line = ch * w
-        qimg = QImage(rgb.data, w, h, bytes_per_line, QImage.Format_RGB888)
-        self.video_label.setPixmap(QPixmap.fromImage(qimg).scaled(
-            self.video_label.size(), Qt.KeepAspectRatio, Qt.SmoothTransformation))
+        mode = "💤 ожидание" if result['idle'] else f"{result['inference_fps']:.1f} FPS"
+        log_writer = get_log_writer()
+        # События, не попавшие в базу журнала, видны оператору сразу
+        log_failures = log_writer.failures()
+        log_status = f" | ⚠️ Не записано в журнал: {log_failures}" if log_failures else ""
+        self.fps_label.setText(f"📷 Камера: {result['capture_fps']:.1f} FPS | "
+                               f"🧠 Распознавание: {mode} | "
+                               f"⚙️ CPU: {result['cpu_percent']:.0f}% | "
+                               f"📝 Журнал в очереди: {log_writer.pending()}{log_status}")
+        
+        # Кадр уменьшается под размер виджета, рамки рисуются уже на копии
+        image, scale = self.renderer.fit(result['frame'], self.video_label.size())
+        draw_faces(image, faces, scale)
+        self.video_label.setPixmap(self.renderer.pixmap(image))
+        
+        self.worker.result_consumed()
     
     def register_new_face(self):
-        """Регистрация нового пользователя с лицом"""
-        ret, frame = self.cap.read()
-        if not ret:
+        """Регистрация нового пользователя: съемка серии кадров
+        
+        Кадры собираются по таймеру, не останавливая распознавание; по
+        окончании серии из них выбираются шаблоны лица (finish_enrollment).
+        """
+        if self.capture is None or self.capture.latest_frame() is None:
             QMessageBox.warning(self, "Ошибка", "Не удалось получить кадр с камеры!")
             return
+        if self.enroll_frames is not None or self.enroller is not None:
+            return
         
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        dets = self.detector(gray)
-        
-        if len(dets) == 0:
-            QMessageBox.warning(self, "❌ Лицо не найдено", 
-                              "Убедитесь, что ваше лицо хорошо видно на камере!")
+        self.enroll_frames = []
+        self.enroll_seq = 0
+        self.enroll_ticks = 0
+        self.register_btn.setEnabled(False)
+        self.set_status(f"📸 Съемка: 0/{ENROLL_BURST_FRAMES} — смотрите в камеру и слегка поворачивайте голову",
+                        "#cce5ff", "#004085")
+        self.enroll_timer.start()
+    
+    def capture_enroll_frame(self):
+        """Очередной кадр серии регистрации"""
+        if self.capture is None:
+            self.cancel_enrollment()
+            return
+        self.enroll_ticks += 1
+        # Камера не успела дать новый кадр — ждем следующего тика
+        if self.capture.seq != self.enroll_seq:
+            self.enroll_seq = self.capture.seq
+            frame = self.capture.latest_frame()
+            if frame is not None:
+                self.enroll_frames.append(frame)
+            self.set_status(f"📸 Съемка: {len(self.enroll_frames)}/{ENROLL_BURST_FRAMES} — "
+                            f"смотрите в камеру и слегка поворачивайте голову", "#cce5ff", "#004085")
+        # Если камера зависла, серия заканчивается тем, что успели снять
+        if len(self.enroll_frames) >= ENROLL_BURST_FRAMES or self.enroll_ticks >= 2 * ENROLL_BURST_FRAMES:
+            frames = self.enroll_frames
+            self.cancel_enrollment()
+            self.set_status("⏳ Обработка снимков...", "#fff3cd", "#856404")
+            self.finish_enrollment(frames)
+    
+    def cancel_enrollment(self):
+        """Прервать съемку серии"""
+        self.enroll_timer.stop()
+        self.enroll_frames = None
+        self.register_btn.setEnabled(self.engine is not None and self.enroller is None)
+    
+    def finish_enrollment(self, frames):
+        """Выбор шаблонов из серии в фоновом потоке — окно продолжает отвечать"""
+        self.register_btn.setEnabled(False)
+        self.enroller = EnrollmentWorker(self.engine, frames)
+        self.enroller.enrolled.connect(self.on_enrolled)
+        self.enroller.failed.connect(self.on_enroll_failed)
+        self.enroller.finished.connect(self.on_enroller_finished)
+        self.enroller.start()
+    
+    def on_enroller_finished(self):
+        self.enroller = None
+        self.register_btn.setEnabled(self.engine is not None and self.enroll_frames is None)
+    
+    def on_enroll_failed(self, error):
+        QMessageBox.critical(self, "Ошибка", f"Не удалось обработать снимки:\n{error}")
+    
+    def on_enrolled(self, result):
+        """Проверка шаблонов серии на качество и повтор, сохранение пользователя"""
+        # Пока шли вычисления, режим распознавания закрыли
+        if not self.active:
+            return
+        templates = result['templates']
+        
+        # Нужно несколько разных шаблонов: почти одинаковые кадры не в счет
+        if len(templates) < ENROLL_MIN_TEMPLATES:
+            if templates:
+                QMessageBox.warning(self, "⚠️ Недостаточно разных снимков",
+                                  f"Получено разных снимков: {len(templates)} из {ENROLL_MIN_TEMPLATES}.\n\n"
+                                  f"Во время съемки медленно поворачивайте голову немного влево и вправо "
+                                  f"и повторите регистрацию.")
+                return
+            if not result['rejected']:
+                QMessageBox.warning(self, "❌ Лицо не найдено", 
+                                  "Убедитесь, что ваше лицо хорошо видно на камере!")
+                return
+            # Плохие снимки ухудшат распознавание этого человека — просим переснять
+            reason = max(result['rejected'], key=result['rejected'].get)
+            QMessageBox.warning(self, "⚠️ Снимки низкого качества",
+                              f"Причина: {QUALITY_HINTS[reason]}.\n\n"
+                              f"Посмотрите прямо в камеру с близкого расстояния и повторите регистрацию.")
             return
         
-        # Получаем encoding лица
-        d = dets[0]
-        shape = self.sp(gray, d)
-        encoding = np.array(self.facerec.compute_face_descriptor(frame, shape))
+        # Проверяем, не зарегистрировано ли это лицо ранее (по всем шаблонам)
+        if result['match']:
+            _, known_student_id, known_name, _ = result['match']
+            reply = QMessageBox.question(self, "⚠️ Лицо уже есть в базе",
+                                         f"Лицо похоже на: {known_name} (ID: {known_student_id})\n\n"
+                                         f"Всё равно зарегистрировать?",
+                                         QMessageBox.Yes | QMessageBox.No)
+            if reply != QMessageBox.Yes:
+                return
         
         # Диалог регистрации
         dialog = RegisterDialog(self)
@@ -273,17 +422,18 @@ class FaceRecognitionWindow(QWidget):
                 return
             
             # Сохраняем в БД
-            if save_face_encoding(data['student_id'], data['first_name'], 
-                                 data['last_name'], data['faculty'], encoding):
+            if save_face_templates(data['student_id'], data['first_name'], 
+                                   data['last_name'], data['faculty'], templates):
                 QMessageBox.information(self, "✅ Успешная регистрация", 
                     f"Пользователь зарегистрирован!\n\n"
                     f"👤 Имя: {data['first_name']} {data['last_name']}\n"
                     f"🆔 ID: {data['student_id']}\n"
-                    f"🎓 Факультет: {data['faculty']}\n\n"
+                    f"🎓 Факультет: {data['faculty']}\n"
+                    f"📸 Снимков лица: {len(templates)}\n\n"
                     f"✅ ДОСТУП В СИСТЕМУ РАЗРЕШЕН!")
                 
-                # Обновляем список пользователей
-                self.known_users = load_all_encodings()
+                # Новый пользователь попадет в галерею перед следующим кадром
+                self.engine.request_sync()
             else:
                 QMessageBox.warning(self, "Ошибка", "Такой ID студента уже существует!")
     
@@ -297,7 +447,7 @@ class FaceRecognitionWindow(QWidget):
         user_id, student_id, full_name = self.current_recognized
         
         # Записываем в лог
-        log_access(user_id, student_id, full_name, action, "Main Entrance")
+        get_log_writer().submit(user_id, student_id, full_name, action, "Main Entrance")
         
         # Определяем стиль сообщения
         if action == "Вход":
@@ -323,8 +473,11 @@ class FaceRecognitionWindow(QWidget):
     
     def closeEvent(self, event):
         """Освобождение ресурсов при закрытии"""
-        if hasattr(self, 'timer'):
-            self.timer.stop()
-        if hasattr(self, 'cap') and self.cap.isOpened():
-            self.cap.release()
+        self.stop()
+        # Загрузку моделей и обработку серии прервать нельзя — дожидаемся их завершения
+        self.loader.wait()
+        if self.enroller is not None:
+            self.enroller.wait()
+        # Дописываем журнал доступа, чтобы не потерять события
+        get_log_writer().flush()
         super().closeEvent(event)
\ No newline at end of file
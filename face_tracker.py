@@ -0,0 +1,125 @@
+from collections import Counter, deque
+
+
+def box_iou(a, b):
+    """IoU двух прямоугольников (left, top, right, bottom)"""
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    """Трек одного лица между кадрами"""
+
+    def __init__(self, track_id, box, history=7):
+        self.track_id = track_id
+        self.box = box
+        # Уверенность трекинга: IoU с рамкой на предыдущем кадре
+        self.confidence = 1.0
+        self.misses = 0
+        self.frames_since_reid = None  # None — лицо еще ни разу не распознавалось
+        self.votes = deque(maxlen=history)
+        self.matches = {}
+
+    def observe(self, match):
+        """Добавить результат распознавания (match или None) в историю трека"""
+        key = match[1] if match else None
+        self.votes.append((key, match[3] if match else None))
+        if match:
+            self.matches[key] = match
+        self.frames_since_reid = 0
+
+    def identity(self):
+        """Сглаженная личность трека: большинство голосов по истории
+
+        Возвращает (user_id, student_id, name, средняя дистанция) или None.
+        """
+        if not self.votes:
+            return None
+        key, _ = Counter(k for k, _ in self.votes).most_common(1)[0]
+        if key is None:
+            return None
+        distances = [d for k, d in self.votes if k == key]
+        user_id, student_id, name, _ = self.matches[key]
+        return (user_id, student_id, name, sum(distances) / len(distances))
+
+
+class FaceTracker:
+    """IoU-трекер лиц с постоянными ID треков
+
+    Дескриптор лица пересчитывается только когда трек новый, раз в
+    reid_interval кадров или когда уверенность трекинга падает ниже
+    min_confidence. Между пересчетами личность берется из истории трека.
+    """
+
+    def __init__(self, iou_threshold=0.3, reid_interval=15, min_confidence=0.5,
+                 max_misses=5, history=7):
+        self.iou_threshold = iou_threshold
+        self.reid_interval = reid_interval
+        self.min_confidence = min_confidence
+        self.max_misses = max_misses
+        self.history = history
+        self.tracks = []
+        self.next_id = 1
+
+    def update(self, boxes):
+        """Сопоставить рамки текущего кадра с треками
+
+        Возвращает список треков в порядке boxes.
+        """
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            for bi, box in enumerate(boxes):
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, ti, bi))
+        # Жадное сопоставление по убыванию IoU
+        pairs.sort(reverse=True)
+
+        assigned = [None] * len(boxes)
+        used_tracks = set()
+        for iou, ti, bi in pairs:
+            if ti in used_tracks or assigned[bi] is not None:
+                continue
+            track = self.tracks[ti]
+            track.box = boxes[bi]
+            track.confidence = iou
+            track.misses = 0
+            if track.frames_since_reid is not None:
+                track.frames_since_reid += 1
+            assigned[bi] = track
+            used_tracks.add(ti)
+
+        for ti, track in enumerate(self.tracks):
+            if ti not in used_tracks:
+                track.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+
+        for bi, box in enumerate(boxes):
+            if assigned[bi] is None:
+                track = Track(self.next_id, box, self.history)
+                self.next_id += 1
+                self.tracks.append(track)
+                assigned[bi] = track
+        return assigned
+
+    def needs_reid(self, track):
+        """Нужно ли заново вычислять дескриптор для трека"""
+        return (track.frames_since_reid is None
+                or track.frames_since_reid >= self.reid_interval
+                or track.confidence < self.min_confidence)
+
+    def invalidate(self):
+        """Пометить все треки для повторного распознавания (например, после смены галереи)"""
+        for track in self.tracks:
+            track.votes.clear()
+            track.matches.clear()
+            track.frames_since_reid = None
+
+    def reset(self):
+        self.tracks = []
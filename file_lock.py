@@ -0,0 +1,74 @@
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: блокировка первого байта файла через msvcrt
+    fcntl = None
+    import msvcrt
+
+# Как часто (в секундах) повторяется попытка захвата в Windows
+LOCK_RETRY_INTERVAL = 0.05
+
+
+class FileLock:
+    """Межпроцессная блокировка на файле-замке
+
+    Используется там, где несколько процессов (окно киоска, пакетные
+    утилиты, бенчмарк) пишут одни и те же файлы. Блокировка привязана к
+    открытому файлу, поэтому исключает и потоки одного процесса. При
+    аварийном завершении процесса ОС снимает ее сама.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self, blocking=True):
+        """Захватить блокировку; без ожидания возвращает False, если она занята"""
+        f = open(self.path, "a+b")
+        try:
+            while not self._try_lock(f):
+                if not blocking:
+                    f.close()
+                    return False
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                    break
+                time.sleep(LOCK_RETRY_INTERVAL)
+        except BaseException:
+            f.close()
+            raise
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+    @staticmethod
+    def _try_lock(f):
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            return False
+        return True
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
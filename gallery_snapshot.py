@@ -0,0 +1,263 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from database import DB_USERS, get_user_changes, load_gallery_rows
+from face_gallery import DESCRIPTOR_SIZE, FaceGallery, TextColumn
+from file_lock import FileLock
+
+# Снимок галереи хранится рядом с базой пользователей
+SNAPSHOT_DIR = os.path.splitext(DB_USERS)[0] + ".gallery"
+SNAPSHOT_FORMAT = 4
+
+# Файлы снимка: сырые массивы фиксированной ширины, которые можно
+# отобразить в память (np.memmap) и дописывать в конец. Строка — шаблон
+# лица (формат 3), шаблоны одного пользователя идут подряд
+SNAPSHOT_FILES = {
+    'encodings': ('encodings.f32', np.dtype('<f4'), (DESCRIPTOR_SIZE,)),
+    'sq_norms': ('sq_norms.f32', np.dtype('<f4'), ()),
+    'user_ids': ('user_ids.i64', np.dtype('<i8'), ()),
+}
+# Строки переменной длины (формат 4): смещения N+1 строк и общий буфер UTF-8
+TEXT_FILES = {
+    'student_ids': ('student_ids.off', 'student_ids.utf8'),
+    'names': ('names.off', 'names.utf8'),
+}
+OFFSET_DTYPE = np.dtype('<i8')
+META_FILE = "meta.json"
+
+# Каждая пересборка пишется в новый каталог версии внутри SNAPSHOT_DIR;
+# текущий каталог указан в файле CURRENT_FILE, который подменяется атомарно.
+# Запись (пересборка и дозапись) выполняется под межпроцессной блокировкой
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+# Сколько последних версий хранится: процесс, успевший прочитать прежний
+# указатель, еще найдет свои файлы
+KEEP_VERSIONS = 2
+# Сколько раз перечитывается указатель, если версию успели удалить
+OPEN_ATTEMPTS = 3
+
+
+def _current_dir(path):
+    """Каталог текущей версии снимка (None, если снимка еще нет)"""
+    try:
+        with open(os.path.join(path, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    return os.path.join(path, name) if name else None
+
+
+def _lock(path):
+    os.makedirs(path, exist_ok=True)
+    return FileLock(os.path.join(path, LOCK_FILE))
+
+
+def _read_meta(path):
+    if path is None:
+        return None
+    try:
+        with open(os.path.join(path, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('format') == SNAPSHOT_FORMAT else None
+
+
+def _write_meta(path, meta):
+    tmp_path = os.path.join(path, META_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(tmp_path, os.path.join(path, META_FILE))
+
+
+def _columns(encodings, student_ids, user_ids, names):
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, DESCRIPTOR_SIZE)
+    return {
+        'encodings': encodings,
+        'sq_norms': np.einsum('ij,ij->i', encodings, encodings),
+        'user_ids': np.asarray(user_ids, dtype=np.int64),
+        'student_ids': TextColumn.from_strings(student_ids),
+        'names': TextColumn.from_strings(names),
+    }
+
+
+def _append_file(path, filename, values):
+    with open(os.path.join(path, filename), "ab") as f:
+        values.tofile(f)
+
+
+def _write_text(path, key, column, size=None):
+    """Записать текстовый столбец целиком или дописать его к буферу из size байт"""
+    offsets_name, data_name = TEXT_FILES[key]
+    offsets = column.offsets.astype(OFFSET_DTYPE, copy=False)
+    if size is None:
+        offsets.tofile(os.path.join(path, offsets_name))
+        column.data.tofile(os.path.join(path, data_name))
+    else:
+        # Первое смещение дописываемой части уже есть в файле
+        _append_file(path, offsets_name, offsets[1:] + size)
+        _append_file(path, data_name, column.data)
+
+
+def _text_size(path, key, count):
+    """Размер буфера UTF-8 для первых count строк (по файлу смещений)"""
+    offsets = np.memmap(os.path.join(path, TEXT_FILES[key][0]), dtype=OFFSET_DTYPE,
+                        mode='r', shape=(count + 1,))
+    return int(offsets[count])
+
+
+def _write_version(rows, seq, path, db_id=None):
+    """Записать снимок в новый каталог версии и сделать его текущим"""
+    version = tempfile.mkdtemp(prefix=f"v{seq}-", dir=path)
+    columns = _columns(*rows)
+    for key, (filename, dtype, _) in SNAPSHOT_FILES.items():
+        columns[key].astype(dtype, copy=False).tofile(os.path.join(version, filename))
+    for key in TEXT_FILES:
+        _write_text(version, key, columns[key])
+    _write_meta(version, {
+        'format': SNAPSHOT_FORMAT,
+        'db_id': db_id,
+        'seq': seq,
+        'count': len(columns['user_ids']),
+    })
+    # Читатели видят либо прежнюю версию целиком, либо новую
+    tmp_path = os.path.join(path, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(os.path.basename(version))
+    os.replace(tmp_path, os.path.join(path, CURRENT_FILE))
+    _remove_old_versions(path)
+
+
+def _remove_old_versions(path):
+    versions = sorted((entry for entry in os.scandir(path)
+                       if entry.is_dir() and entry.name.startswith("v")),
+                      key=lambda entry: entry.stat().st_mtime)
+    current = os.path.basename(_current_dir(path))
+    keep = {current} | {entry.name for entry in versions[-KEEP_VERSIONS:]}
+    for entry in os.scandir(path):
+        if entry.name in keep or entry.name in (CURRENT_FILE, LOCK_FILE):
+            continue
+        # Отображенный в память файл в Windows удалить нельзя — уберется в следующий раз
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def _append_version(rows, seq, path):
+    """Дописать новые записи в файлы текущей версии
+
+    Файлы только растут, а число строк читатели берут из meta.json,
+    который подменяется атомарно последним: процесс со старым meta.json
+    видит прежние строки без изменений.
+    """
+    version = _current_dir(path)
+    meta = _read_meta(version)
+    count = meta['count']
+    columns = _columns(*rows)
+    for key, (filename, dtype, shape) in SNAPSHOT_FILES.items():
+        # Хвост от прерванной ранее дозаписи отбрасывается
+        with open(os.path.join(version, filename), "r+b") as f:
+            f.truncate(count * dtype.itemsize * int(np.prod(shape)))
+        _append_file(version, filename, columns[key].astype(dtype, copy=False))
+    for key, (offsets_name, data_name) in TEXT_FILES.items():
+        size = _text_size(version, key, count)
+        with open(os.path.join(version, offsets_name), "r+b") as f:
+            f.truncate((count + 1) * OFFSET_DTYPE.itemsize)
+        with open(os.path.join(version, data_name), "r+b") as f:
+            f.truncate(size)
+        _write_text(version, key, columns[key], size)
+    meta.update({
+        'seq': seq,
+        'count': count + len(columns['user_ids']),
+    })
+    _write_meta(version, meta)
+
+
+def write_snapshot(rows, seq, path=SNAPSHOT_DIR, db_id=None):
+    """Полная пересборка снимка из (encodings, student_ids, user_ids, names)"""
+    with _lock(path):
+        _write_version(rows, seq, path, db_id)
+
+
+def append_snapshot(rows, seq, path=SNAPSHOT_DIR):
+    """Дописать в снимок новые записи (только добавления, без изменений старых)"""
+    with _lock(path):
+        _append_version(rows, seq, path)
+
+
+def open_snapshot(path=SNAPSHOT_DIR):
+    """Отобразить снимок в память и построить FaceGallery без копирования данных"""
+    for attempt in range(OPEN_ATTEMPTS):
+        try:
+            return _open_version(_current_dir(path))
+        except FileNotFoundError:
+            # Между чтением указателя и открытием файлов версию сменили дважды
+            if attempt == OPEN_ATTEMPTS - 1:
+                raise
+
+
+def _open_version(version):
+    meta = _read_meta(version)
+    if meta is None:
+        raise FileNotFoundError(f"Снимок галереи не найден: {version}")
+    count = meta['count']
+    arrays = {}
+    for key, (filename, dtype, shape) in SNAPSHOT_FILES.items():
+        if count == 0:
+            arrays[key] = np.empty((0,) + shape, dtype=dtype)
+        else:
+            arrays[key] = np.memmap(os.path.join(version, filename), dtype=dtype,
+                                    mode='r', shape=(count,) + shape)
+    for key, (offsets_name, data_name) in TEXT_FILES.items():
+        offsets = np.memmap(os.path.join(version, offsets_name), dtype=OFFSET_DTYPE,
+                            mode='r', shape=(count + 1,))
+        size = int(offsets[count])
+        # Пустой файл отобразить нельзя
+        data = (np.memmap(os.path.join(version, data_name), dtype=np.uint8, mode='r', shape=(size,))
+                if size else np.empty(0, dtype=np.uint8))
+        arrays[key] = TextColumn(offsets, data)
+    gallery = FaceGallery(arrays['encodings'], arrays['student_ids'], arrays['user_ids'],
+                          arrays['names'], sq_norms=arrays['sq_norms'])
+    gallery.db_id = meta.get('db_id')
+    gallery.version = meta['seq']
+    return gallery
+
+
+def sync_snapshot(path=SNAPSHOT_DIR):
+    """Привести снимок в соответствие с базой по ленте изменений users_changes
+
+    Если база не менялась, ничего не делается. Если в нее только добавлялись
+    записи, они дописываются в конец снимка; иначе снимок пересобирается.
+    Пересобирается он и для другой базы (новой или восстановленной из
+    копии): у нее другой db_id или лента изменений короче снимка.
+    Проверка и запись выполняются под блокировкой: процессы, запущенные
+    одновременно, не пишут снимок вдвоем. Возвращает 'fresh', 'appended'
+    или 'rebuilt'.
+    """
+    with _lock(path):
+        meta = _read_meta(_current_dir(path))
+        if meta is not None:
+            changes = get_user_changes(meta['seq'])
+            if changes['db_id'] == meta.get('db_id') and changes['seq'] >= meta['seq']:
+                if changes['seq'] == meta['seq']:
+                    return 'fresh'
+                if changes['only_inserts']:
+                    _append_version(changes['rows'], changes['seq'], path)
+                    return 'appended'
+        data = load_gallery_rows()
+        _write_version(data['rows'], data['seq'], path, data['db_id'])
+        return 'rebuilt'
+
+
+def load_snapshot_gallery(path=SNAPSHOT_DIR):
+    """Галерея из снимка в памяти, предварительно синхронизированного с базой"""
+    sync_snapshot(path)
+    return open_snapshot(path)
@@ -0,0 +1,55 @@
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from database import get_logs_data_version
+from log_writer import add_log_listener, remove_log_listener
+
+# Как часто (в мс) проверяется запись журнала другими процессами
+LOG_WATCH_INTERVAL = 1000
+
+
+class AccessLogWatcher(QObject):
+    """Уведомления о новых событиях журнала доступа
+
+    Записи этого процесса приходят сразу от фонового писателя журнала
+    (log_writer), записи других процессов обнаруживаются по PRAGMA
+    data_version раз в interval мс. Оба пути сверяют data_version с
+    запомненным значением, поэтому одна пачка дает одно уведомление, кто
+    бы ее ни заметил первым. Сигнал changed испускается в потоке GUI;
+    пока наблюдатель остановлен, база не опрашивается.
+    """
+
+    changed = pyqtSignal()
+    # Сигнал из потока писателя доставляется в поток GUI через очередь Qt
+    _written = pyqtSignal()
+
+    def __init__(self, interval=LOG_WATCH_INTERVAL, parent=None):
+        super().__init__(parent)
+        self.data_version = None
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.check)
+        # Коммит писателя меняет и data_version — проверка его же поглощает
+        self._written.connect(self.check)
+
+    def start(self):
+        """Начать наблюдение (без уведомления о том, что было записано раньше)"""
+        if self.timer.isActive():
+            return
+        self.data_version = get_logs_data_version()
+        add_log_listener(self._on_written)
+        self.timer.start()
+
+    def stop(self):
+        """Прекратить наблюдение"""
+        remove_log_listener(self._on_written)
+        self.timer.stop()
+
+    def check(self):
+        """Проверить, менял ли кто-то базу журнала с прошлой проверки"""
+        version = get_logs_data_version()
+        if version != self.data_version:
+            self.data_version = version
+            self.changed.emit()
+
+    def _on_written(self, count):
+        self._written.emit()
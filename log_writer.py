@@ -0,0 +1,260 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from database import DB_LOGS, close_thread_connections, insert_access_logs, rollover_logs
+
+logger = logging.getLogger(__name__)
+
+# Параметры группового коммита по умолчанию
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_INTERVAL = 0.5
+
+# Повтор записи пачки при временной ошибке базы (заблокирована, нет места):
+# задержка удваивается от LOG_RETRY_DELAY до LOG_RETRY_MAX_DELAY секунд
+LOG_WRITE_ATTEMPTS = 5
+LOG_RETRY_DELAY = 0.5
+LOG_RETRY_MAX_DELAY = 8.0
+
+# Пачки, которые так и не удалось записать, сохраняются сюда (JSON Lines)
+# и дописываются в базу при следующем запуске писателя
+LOG_FALLBACK_PATH = os.path.splitext(DB_LOGS)[0] + ".failed.jsonl"
+
+# Как часто (в секундах) писатель переносит прошлые месяцы журнала в
+# партиции (database.rollover_logs); первый перенос — сразу после запуска
+LOG_ROLLOVER_INTERVAL = 3600.0
+
+
+class AccessLogWriter(threading.Thread):
+    """Фоновая запись журнала доступа с групповым коммитом
+
+    События складываются в ограниченную очередь и записываются в
+    access_logs пачками: коммит выполняется, когда набралось batch_size
+    событий или прошло flush_interval секунд с первого события пачки.
+    Если очередь заполнена, submit() ждет (события не отбрасываются).
+
+    Гарантии сохранности:
+      * при штатном завершении (close(), closeEvent, выход из приложения)
+        очередь дописывается полностью — события не теряются;
+      * при аварийном завершении процесса теряются события, еще не
+        записанные в базу: не больше batch_size событий или flush_interval
+        секунд, плюс все, что ожидало в очереди;
+      * при отключении питания дополнительно могут пропасть последние
+        закоммиченные пачки (WAL с synchronous=NORMAL, см. database.get_connection);
+      * если база недоступна дольше LOG_WRITE_ATTEMPTS попыток, пачка
+        сохраняется в LOG_FALLBACK_PATH и будет записана при следующем
+        запуске; если не удалось и это, пачка отбрасывается. Такие события
+        считает failures(), ошибки пишутся в журнал logging.
+    """
+
+    def __init__(self, max_queue=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, rollover_interval=LOG_ROLLOVER_INTERVAL):
+        super().__init__(name="AccessLogWriter", daemon=True)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rollover_interval = rollover_interval
+        self._next_rollover = 0.0
+        self.submitted = 0
+        self.written = 0
+        self.saved = 0      # сохранено в LOG_FALLBACK_PATH
+        self.dropped = 0    # потеряно
+        self.last_error = None
+        # После неудачной пачки следующие не ждут полного цикла повторов —
+        # иначе при недоступной базе выход из приложения затянулся бы
+        self._failing = False
+        self._counter_lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def submit(self, user_id, student_id, full_name, action, location="Main Entrance"):
+        """Поставить событие в очередь; время события фиксируется в момент вызова"""
+        # Тот же формат и часовой пояс (UTC), что у CURRENT_TIMESTAMP в SQLite
+        timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        with self._counter_lock:
+            self.submitted += 1
+        self.queue.put((user_id, student_id, full_name, action, location, timestamp))
+
+    def pending(self):
+        """Количество событий, еще не обработанных писателем"""
+        with self._counter_lock:
+            return self.submitted - self.written - self.saved - self.dropped
+
+    def failures(self):
+        """Количество событий, не попавших в базу (сохраненных в запасной файл или потерянных)"""
+        with self._counter_lock:
+            return self.saved + self.dropped
+
+    def flush(self, timeout=None):
+        """Дождаться записи всех поставленных в очередь событий"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending() and self.is_alive():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return self.pending() == 0
+
+    def close(self):
+        """Дописать очередь и остановить поток"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        try:
+            try:
+                self._replay_fallback()
+            except Exception:
+                logger.exception("Журнал доступа: не удалось прочитать %s", LOG_FALLBACK_PATH)
+            while not (self._stop_event.is_set() and self.queue.empty()):
+                if self.rollover_interval and time.monotonic() >= self._next_rollover:
+                    self._rollover()
+                batch = self._collect_batch()
+                if batch:
+                    self._write(batch)
+        finally:
+            close_thread_connections()
+
+    def _collect_batch(self):
+        try:
+            first = self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (self._stop_event.is_set() and self.queue.empty()):
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(remaining, 0.05)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _insert(self, batch):
+        """Записать пачку с повторами при временных ошибках; True при успехе"""
+        attempts = 1 if self._failing else LOG_WRITE_ATTEMPTS
+        delay = LOG_RETRY_DELAY
+        for attempt in range(1, attempts + 1):
+            try:
+                insert_access_logs(batch)
+                self._failing = False
+                return True
+            except sqlite3.OperationalError as e:
+                # База заблокирована другим процессом, нет места, только чтение
+                self.last_error = str(e)
+                logger.warning("Журнал доступа: ошибка записи (попытка %d из %d): %s",
+                               attempt, attempts, e)
+                if attempt < attempts:
+                    time.sleep(delay)
+                    delay = min(delay * 2, LOG_RETRY_MAX_DELAY)
+            except Exception as e:
+                # Повтор не поможет (например, поврежденная база)
+                self.last_error = str(e)
+                logger.exception("Журнал доступа: пачка из %d событий не записана", len(batch))
+                break
+        self._failing = True
+        return False
+
+    def _write(self, batch):
+        if self._insert(batch):
+            with self._counter_lock:
+                self.written += len(batch)
+            self._notify(len(batch))
+            return
+        try:
+            with open(LOG_FALLBACK_PATH, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in batch)
+        except OSError:
+            logger.exception("Журнал доступа: потеряно %d событий", len(batch))
+            with self._counter_lock:
+                self.dropped += len(batch)
+        else:
+            logger.error("Журнал доступа: %d событий сохранены в %s", len(batch), LOG_FALLBACK_PATH)
+            with self._counter_lock:
+                self.saved += len(batch)
+
+    def _replay_fallback(self):
+        """Дописать в базу события, сохраненные в запасной файл при прошлых сбоях"""
+        # Файл забирается переименованием — два процесса не запишут его дважды
+        claimed = f"{LOG_FALLBACK_PATH}.{os.getpid()}"
+        try:
+            os.replace(LOG_FALLBACK_PATH, claimed)
+        except OSError:
+            return
+        with open(claimed, encoding="utf-8") as f:
+            rows = [tuple(json.loads(line)) for line in f if line.strip()]
+        if rows and self._insert(rows):
+            logger.info("Журнал доступа: дописано %d событий из %s", len(rows), LOG_FALLBACK_PATH)
+            self._notify(len(rows))
+        elif rows:
+            # База все еще недоступна — события возвращаются в запасной файл
+            with open(LOG_FALLBACK_PATH, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        os.remove(claimed)
+
+    def _rollover(self):
+        # Перенос идет в этом же потоке, поэтому не пересекается с записью пачек
+        self._next_rollover = time.monotonic() + self.rollover_interval
+        try:
+            report = rollover_logs()
+        except Exception:
+            logger.exception("Журнал доступа: ошибка переноса прошлых месяцев в партиции")
+            return
+        if report and any(report.values()):
+            logger.info("Журнал доступа: партиции обновлены: %s", report)
+
+    def _notify(self, count):
+        for callback in list(_listeners):
+            try:
+                callback(count)
+            except Exception:
+                logger.exception("Журнал доступа: ошибка подписчика")
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+# Подписчики на запись журнала: вызываются в потоке писателя после
+# каждого коммита с числом записанных событий
+_listeners = []
+
+
+def add_log_listener(callback):
+    """Подписаться на запись новых событий журнала в этом процессе"""
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+def remove_log_listener(callback):
+    """Отписаться от уведомлений о записи журнала"""
+    if callback in _listeners:
+        _listeners.remove(callback)
+
+
+def get_log_writer():
+    """Общий для процесса фоновый писатель журнала (запускается при первом вызове)"""
+    global _writer
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = AccessLogWriter()
+            _writer.start()
+        return _writer
+
+
+def shutdown_log_writer():
+    """Дописать очередь журнала и остановить фоновый поток"""
+    with _writer_lock:
+        if _writer is not None:
+            _writer.close()
+
+
+# Очередь дописывается и при обычном выходе интерпретатора
+atexit.register(shutdown_log_writer)
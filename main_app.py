@@ -1,3 +1,4 @@
+import logging
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                              QHBoxLayout, QLabel, QPushButton, QDialog, 
@@ -7,6 +8,7 @@ from PyQt5.QtGui import QFont
 from auth_db import login_user
 from admin_panel import AdminPanel
 from face_recognition_window import FaceRecognitionWindow
+from log_writer import get_log_writer, shutdown_log_writer
 
 
 class LoginWindow(QDialog):
@@ -183,6 +185,9 @@ class MainWindow(QMainWindow):
         self.admin_panel = AdminPanel()
         self.face_recognition = FaceRecognitionWindow()
         
+        # Удаление пользователя в админ-панели сразу убирает его из галереи
+        self.admin_panel.users_changed.connect(self.face_recognition.sync_gallery)
+        
         self.stacked_widget.addWidget(self.menu_widget)
         self.stacked_widget.addWidget(self.admin_panel)
         self.stacked_widget.addWidget(self.face_recognition)
@@ -299,6 +304,12 @@ class MainWindow(QMainWindow):
         widget.setLayout(layout)
         return widget
     
+    def closeEvent(self, event):
+        """Остановка камеры и запись журнала доступа при выходе"""
+        self.face_recognition.close()
+        shutdown_log_writer()
+        super().closeEvent(event)
+    
     def switch_mode(self, index):
         """Переключение между режимами"""
         self.stacked_widget.setCurrentIndex(index)
@@ -311,14 +322,14 @@ class MainWindow(QMainWindow):
         
         # Управление камерой для режима распознавания
         if index == 2:
-            if hasattr(self.face_recognition, 'timer'):
-                self.face_recognition.timer.start()
+            self.face_recognition.start()
         else:
-            if hasattr(self.face_recognition, 'timer'):
-                self.face_recognition.timer.stop()
+            self.face_recognition.stop()
 
 
 def main():
+    # Ошибки фоновых потоков (например, записи журнала) выводятся в stderr
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
     app = QApplication(sys.argv)
     
     # Окно авторизации
@@ -326,6 +337,10 @@ def main():
     if login.exec_() != QDialog.Accepted:
         sys.exit(0)
     
+    # Писатель журнала запускается сразу: он же периодически переносит
+    # прошлые месяцы журнала в партиции
+    get_log_writer()
+    
     # Главное окно
     window = MainWindow(login.admin_name)
     window.show()
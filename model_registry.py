@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import dlib
+
+SHAPE_PREDICTOR_PATH = "dat/shape_predictor_68_face_landmarks.dat"
+FACE_REC_MODEL_PATH = "dat/dlib_face_recognition_resnet_model_v1.dat"
+
+# Контрольные суммы моделей в формате sha256sum (проверяются `sha256sum -c`)
+CHECKSUMS_PATH = "dat/SHA256SUMS"
+
+logger = logging.getLogger(__name__)
+
+
+class ModelChecksumError(ValueError):
+    """Файл модели не совпадает с контрольной суммой из CHECKSUMS_PATH"""
+
+
+class SerializedModel:
+    """Общий экземпляр модели, вызовы которого выполняются по очереди
+
+    Сеть face_recognition_model_v1 хранит промежуточные буферы внутри
+    себя, поэтому одновременные вызовы из разных потоков недопустимы.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        method = getattr(self.model, name)
+
+        def call(*args, **kwargs):
+            with self.lock:
+                return method(*args, **kwargs)
+        return call
+
+
+def current_rss():
+    """Резидентная память процесса в байтах (None, если определить не удалось)
+
+    В Linux читается текущее значение из /proc; в других системах с модулем
+    resource — пиковое.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в macOS — в байтах, в Linux и BSD — в килобайтах
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def file_sha256(path):
+    """SHA-256 файла (читается блоками, целиком в память не загружается)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_checksums(path=CHECKSUMS_PATH):
+    """Контрольные суммы {имя файла: sha256}; пустой словарь, если файла нет"""
+    checksums = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.split(None, 1)
+                if len(parts) == 2:
+                    checksums[os.path.basename(parts[1].strip().lstrip("*"))] = parts[0].lower()
+    except OSError:
+        pass
+    return checksums
+
+
+def write_checksums(paths, path=CHECKSUMS_PATH):
+    """Записать контрольные суммы файлов моделей в CHECKSUMS_PATH"""
+    lines = [f"{file_sha256(p)}  {os.path.basename(p)}\n" for p in paths]
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(lines)
+    return path
+
+
+class ModelRegistry:
+    """Модели dlib, загружаемые один раз на процесс
+
+    Каждый файл модели загружается при первом запросе; остальные
+    потребители (окна, воркеры, пакетные утилиты) получают тот же
+    экземпляр. Параллельные запросы одной модели ждут одной загрузки,
+    разные модели грузятся независимо. Перед загрузкой файл сверяется с
+    контрольной суммой из CHECKSUMS_PATH, если она там указана; иначе он
+    не хешируется, а в журнал пишется предупреждение.
+    """
+
+    def __init__(self, checksums_path=CHECKSUMS_PATH):
+        self.checksums_path = checksums_path
+        self.models = {}
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, kind, path, loader, serialized=False):
+        """Общий экземпляр модели kind из файла path (loader(path) при первом запросе)"""
+        key = (kind, os.path.abspath(path))
+        model = self.models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key not in self.models:
+                model = self._load(key, path, loader)
+                self.models[key] = SerializedModel(model) if serialized else model
+        return self.models[key]
+
+    def _load(self, key, path, loader):
+        expected = read_checksums(self.checksums_path).get(os.path.basename(path))
+        sha256 = None
+        if expected is None:
+            # Хеш файла в ~100 МБ без ожидаемой суммы ничего не проверяет
+            logger.warning("Модель %s не проверяется: нет контрольной суммы в %s",
+                           path, self.checksums_path)
+        else:
+            sha256 = file_sha256(path)
+            if expected != sha256:
+                raise ModelChecksumError(
+                    f"Контрольная сумма {path} не совпадает: {sha256}, ожидалась {expected}")
+        rss_before = current_rss()
+        start = time.perf_counter()
+        model = loader(path)
+        load_time = time.perf_counter() - start
+        rss_after = current_rss()
+        self.stats[key] = {
+            'kind': key[0],
+            'path': path,
+            'size': os.path.getsize(path),
+            'sha256': sha256,
+            'verified': expected is not None,
+            'load_time_s': round(load_time, 3),
+            'rss_delta': None if rss_before is None else rss_after - rss_before,
+        }
+        return model
+
+    def report(self):
+        """Загруженные модели: время загрузки, прирост памяти, контрольные суммы"""
+        return {
+            'models': list(self.stats.values()),
+            'rss': current_rss(),
+        }
+
+
+_registry = ModelRegistry()
+
+
+def get_registry():
+    """Общий для процесса реестр моделей"""
+    return _registry
+
+
+def get_detector():
+    """Детектор лиц HOG
+
+    Встроен в dlib (файла нет) и создается за миллисекунды, но хранит
+    состояние сканирования внутри себя — каждому потребителю свой экземпляр.
+    """
+    return dlib.get_frontal_face_detector()
+
+
+def get_shape_predictor(path=SHAPE_PREDICTOR_PATH):
+    """Общий предсказатель 68 точек лица (безопасен для вызова из разных потоков)"""
+    return _registry.get('shape_predictor', path, dlib.shape_predictor)
+
+
+def get_face_recognition_model(path=FACE_REC_MODEL_PATH):
+    """Общая сеть дескрипторов лица; вызовы из разных потоков выполняются по очереди"""
+    return _registry.get('face_recognition', path, dlib.face_recognition_model_v1,
+                         serialized=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Загрузка моделей dlib: проверка контрольных сумм, время загрузки и память")
+    parser.add_argument("--write-checksums", action="store_true",
+                        help=f"записать контрольные суммы текущих файлов моделей в {CHECKSUMS_PATH}")
+    args = parser.parse_args(argv)
+
+    if args.write_checksums:
+        print(write_checksums([SHAPE_PREDICTOR_PATH, FACE_REC_MODEL_PATH]))
+        return 0
+    get_shape_predictor()
+    get_face_recognition_model()
+    print(json.dumps(_registry.report(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# Параметры детектора движения по умолчанию
+MOTION_THUMB_WIDTH = 64       # ширина миниатюры для сравнения кадров
+MOTION_PIXEL_THRESHOLD = 15   # изменение яркости пикселя миниатюры (0-255)
+MOTION_MIN_AREA = 0.005       # доля изменившихся пикселей, считающаяся движением
+MOTION_IDLE_AFTER = 3.0       # секунд без движения и лиц до перехода в ожидание
+MOTION_IDLE_INTERVAL = 1.0    # секунд между детекциями в режиме ожидания
+
+# Настройки отдельных камер (номер устройства или путь -> параметры MotionGate),
+# например {0: {'pixel_threshold': 25}} для шумной камеры в темном коридоре
+CAMERA_MOTION_SETTINGS = {}
+
+
+class MotionGate:
+    """Пропуск детекции лиц, пока сцена неподвижна и пуста
+
+    Каждый кадр уменьшается до миниатюры шириной thumb_width и
+    сравнивается с предыдущей. Если дольше idle_after секунд нет ни
+    движения, ни лиц, детекция выполняется раз в idle_interval секунд;
+    первое же движение возвращает ее на каждый кадр. Пока в кадре есть
+    лица, детекция не пропускается, даже если люди стоят неподвижно.
+    """
+
+    def __init__(self, thumb_width=MOTION_THUMB_WIDTH, pixel_threshold=MOTION_PIXEL_THRESHOLD,
+                 min_area=MOTION_MIN_AREA, idle_after=MOTION_IDLE_AFTER,
+                 idle_interval=MOTION_IDLE_INTERVAL):
+        self.thumb_width = thumb_width
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.idle_after = idle_after
+        self.idle_interval = idle_interval
+        self.stats = {'frames': 0, 'skipped': 0, 'wakeups': 0,
+                      'time_to_first_detection': deque(maxlen=1000)}
+        self.reset()
+
+    @classmethod
+    def for_camera(cls, camera):
+        """Детектор движения с настройками камеры из CAMERA_MOTION_SETTINGS"""
+        return cls(**CAMERA_MOTION_SETTINGS.get(camera, {}))
+
+    def reset(self):
+        """Начать заново (следующие кадры обрабатываются с полной частотой)"""
+        self.previous = None
+        self.idle = False
+        self.last_activity = None
+        self.last_detection = None
+        self.woke_at = None
+
+    def _thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        tw, th = self.thumb_width, max(1, round(h * self.thumb_width / w))
+        # INTER_AREA по всему кадру стоит ~0.3 мс (1.6 мс для 1080p); выборка
+        # в миниатюру двойного размера и усреднение 2x2 — ~0.04 мс
+        thumb = cv2.resize(frame, (tw * 2, th * 2), interpolation=cv2.INTER_LINEAR)
+        thumb = cv2.resize(thumb, (tw, th), interpolation=cv2.INTER_AREA)
+        if thumb.ndim == 3:
+            thumb = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+        # Размытие гасит шум матрицы, который иначе выглядит как движение
+        return cv2.GaussianBlur(thumb, (3, 3), 0)
+
+    def motion(self, frame):
+        """Есть ли заметное изменение по сравнению с предыдущим кадром"""
+        thumb = self._thumbnail(frame)
+        previous, self.previous = self.previous, thumb
+        if previous is None or previous.shape != thumb.shape:
+            return True
+        changed = cv2.absdiff(thumb, previous) > self.pixel_threshold
+        return np.count_nonzero(changed) >= self.min_area * changed.size
+
+    def should_detect(self, frame, has_faces, now=None):
+        """Нужно ли запускать детекцию лиц на этом кадре"""
+        now = time.monotonic() if now is None else now
+        self.stats['frames'] += 1
+        if self.motion(frame) or has_faces or self.last_activity is None:
+            if self.idle:
+                self.idle = False
+                self.woke_at = now
+                self.stats['wakeups'] += 1
+            self.last_activity = now
+        elif not self.idle and now - self.last_activity >= self.idle_after:
+            self.idle = True
+            # Движение без лиц (тень, свет) — пробуждение не дождалось лица
+            self.woke_at = None
+
+        if self.idle and self.last_detection is not None \
+                and now - self.last_detection < self.idle_interval:
+            self.stats['skipped'] += 1
+            return False
+        self.last_detection = now
+        return True
+
+    def observe(self, faces, now=None):
+        """Сообщить результат детекции: замеряется время от пробуждения до первого лица"""
+        if faces and self.woke_at is not None:
+            now = time.monotonic() if now is None else now
+            self.stats['time_to_first_detection'].append(now - self.woke_at)
+            self.woke_at = None
+
+    def summary(self):
+        """Статистика: доля пропущенных кадров, пробуждения и время до первого лица (мс)"""
+        frames = self.stats['frames']
+        ttfd = np.asarray(self.stats['time_to_first_detection']) * 1000.0
+        return {
+            'frames': frames,
+            'skipped': self.stats['skipped'],
+            'skipped_fraction': round(self.stats['skipped'] / frames, 3) if frames else 0.0,
+            'wakeups': self.stats['wakeups'],
+            'time_to_first_detection_ms': {
+                'count': len(ttfd),
+                'mean': round(float(ttfd.mean()), 1) if len(ttfd) else None,
+                'max': round(float(ttfd.max()), 1) if len(ttfd) else None,
+            },
+        }
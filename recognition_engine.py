@@ -0,0 +1,346 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import dlib
+import numpy as np
+
+from database import get_user_changes
+from face_detector import FaceDetector
+from face_quality import FaceQuality
+from gallery_snapshot import load_snapshot_gallery
+from face_tracker import FaceTracker
+from motion_gate import MotionGate
+from model_registry import (FACE_REC_MODEL_PATH, SHAPE_PREDICTOR_PATH, get_detector,
+                            get_face_recognition_model, get_shape_predictor)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Как часто (в секундах) галерея проверяет ленту изменений базы
+GALLERY_SYNC_INTERVAL = 1.0
+
+# Регистрация серией кадров: сколько шаблонов лица сохраняется на человека
+ENROLL_MAX_TEMPLATES = 5
+ENROLL_MIN_TEMPLATES = 2
+# Шаблоны ближе этого расстояния почти совпадают — второй ничего не добавляет
+ENROLL_DUPLICATE_DISTANCE = 0.15
+
+
+def load_gallery():
+    """Загрузка галереи известных лиц из снимка, синхронизированного с базой"""
+    gallery = load_snapshot_gallery()
+    # Для очень больших галерей включается приближенный поиск (IVF)
+    gallery.enable_ann()
+    return gallery
+
+
+# ==================== ИСТОЧНИКИ КАДРОВ ====================
+
+def capture_frames(source):
+    """Кадры с камеры (номер устройства) или из видеофайла"""
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"Не удалось открыть источник видео: {source}")
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield frame
+    finally:
+        cap.release()
+
+
+def image_dir_frames(path):
+    """Кадры из папки с изображениями (в алфавитном порядке)"""
+    for name in sorted(os.listdir(path)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        frame = cv2.imread(os.path.join(path, name))
+        if frame is not None:
+            yield frame
+
+
+def open_source(source):
+    """Источник кадров по строке: номер камеры, видеофайл или папка с изображениями
+
+    Возвращает (генератор кадров, continuous) — continuous=False для
+    папки с изображениями, где соседние кадры не связаны между собой.
+    """
+    if str(source).isdigit():
+        return capture_frames(int(source)), True
+    if os.path.isdir(source):
+        return image_dir_frames(source), False
+    return capture_frames(source), True
+
+
+# ==================== ДВИЖОК РАСПОЗНАВАНИЯ ====================
+
+def _record(timings, stage, start):
+    """Добавить длительность этапа в timings (если замер включен); возвращает текущее время"""
+    now = time.perf_counter()
+    if timings is not None:
+        timings.setdefault(stage, []).append(now - start)
+    return now
+
+
+class RecognitionEngine:
+    """Движок распознавания лиц без зависимости от Qt
+
+    Берет модели dlib из общего реестра процесса (model_registry) и
+    превращает кадр (BGR) в список распознанных лиц. GUI и консольный
+    режим — лишь потребители движка.
+    """
+
+    def __init__(self, gallery=None, shape_predictor_path=SHAPE_PREDICTOR_PATH,
+                 face_rec_model_path=FACE_REC_MODEL_PATH, motion_gate=None):
+        # Модели dlib загружаются один раз на процесс и общие для всех движков
+        self.detector = get_detector()
+        self.sp = get_shape_predictor(shape_predictor_path)
+        self.facerec = get_face_recognition_model(face_rec_model_path)
+
+        self.face_detector = FaceDetector(self.detector)
+        # Лица ниже порога качества не доходят до дескриптора
+        self.quality = FaceQuality()
+        self.enroll_quality = FaceQuality.for_enrollment()
+        self.quality_stats = {'passed': 0, 'rejected': 0}
+        self.tracker = FaceTracker()
+        # Детектор движения перед детекцией лиц (None — детекция на каждом кадре)
+        self.motion_gate = motion_gate
+        self.gallery = gallery if gallery is not None else load_gallery()
+        self._gallery_changed = False
+        self._sync_requested = False
+        self._last_sync = time.monotonic()
+
+    def request_sync(self):
+        """Попросить применить изменения базы перед обработкой следующего кадра
+
+        Безопасно вызывать из любого потока: сама синхронизация выполняется
+        в потоке, который вызывает process().
+        """
+        self._sync_requested = True
+
+    def sync_gallery(self):
+        """Применить к галерее только изменившиеся с прошлой синхронизации записи"""
+        self._sync_requested = False
+        self._last_sync = time.monotonic()
+        if self.gallery.version is None:
+            return False
+        changes = get_user_changes(self.gallery.version)
+        if changes['db_id'] != self.gallery.db_id or changes['seq'] < self.gallery.version:
+            # База заменена или восстановлена из копии — лента изменений
+            # начата заново, галерея перечитывается целиком
+            self.gallery = load_gallery()
+            self._gallery_changed = True
+            return True
+        if changes['seq'] == self.gallery.version:
+            return False
+        self.gallery.apply_changes(changes)
+        self._gallery_changed = True
+        return True
+
+    def reset(self):
+        """Сбросить состояние потока (трекер и области интереса детектора)"""
+        self.tracker.reset()
+        self.face_detector.reset()
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+
+    @property
+    def idle(self):
+        """Сцена неподвижна и пуста — детекция выполняется с пониженной частотой"""
+        return self.motion_gate is not None and self.motion_gate.idle
+
+    def process(self, frame, timings=None, now=None):
+        """Распознавание всех лиц кадра
+
+        Лица сопровождаются трекером: дескриптор вычисляется только для новых
+        треков, раз в reid_interval кадров или при падении уверенности
+        трекинга. Лица ниже порога качества (FaceQuality) пропускаются —
+        трек получит дескриптор на одном из следующих кадров. Возвращает
+        список ((left, top, right, bottom), match), где match —
+        (user_id, student_id, name, distance) или None.
+
+        Если передан словарь timings, в него добавляются длительности этапов
+        gate, detect, landmarks (вместе с оценкой качества), descriptor и
+        match (в секундах). now — время кадра для детектора движения (по
+        умолчанию текущее).
+        """
+        if self._sync_requested or time.monotonic() - self._last_sync >= GALLERY_SYNC_INTERVAL:
+            self.sync_gallery()
+        if self._gallery_changed:
+            self._gallery_changed = False
+            self.tracker.invalidate()
+
+        start = time.perf_counter()
+        if self.motion_gate is not None:
+            # Живые треки — в кадре есть лица, пропускать детекцию нельзя
+            detect = self.motion_gate.should_detect(frame, bool(self.tracker.tracks), now)
+            start = _record(timings, 'gate', start)
+            if not detect:
+                return []
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        dets = self.face_detector.detect(gray)
+        boxes = [(d.left(), d.top(), d.right(), d.bottom()) for d in dets]
+        tracks = self.tracker.update(boxes)
+        if self.motion_gate is not None:
+            self.motion_gate.observe(boxes, now)
+        start = _record(timings, 'detect', start)
+
+        # Landmarks всех лиц, которым нужно распознавание, собираются вместе:
+        # дескрипторы вычисляются одним вызовом и сверяются с галереей
+        # одной матричной операцией (N x 128)
+        shapes = dlib.full_object_detections()
+        reid_tracks = []
+        for d, box, track in zip(dets, boxes, tracks):
+            if not self.tracker.needs_reid(track):
+                continue
+            # Мелкие лица отсеиваются еще до landmarks
+            shape = self.sp(gray, d) if self.quality.large_enough(box) else None
+            if shape is None or not self.quality.assess(gray, box, shape)['ok']:
+                self.quality_stats['rejected'] += 1
+                continue
+            self.quality_stats['passed'] += 1
+            shapes.append(shape)
+            reid_tracks.append(track)
+        start = _record(timings, 'landmarks', start)
+
+        if reid_tracks:
+            descriptors = np.array(self.facerec.compute_face_descriptor(frame, shapes))
+            start = _record(timings, 'descriptor', start)
+            matches = self.gallery.match(descriptors)
+            _record(timings, 'match', start)
+            for track, match in zip(reid_tracks, matches):
+                track.observe(match)
+
+        return [(box, track.identity()) for box, track in zip(boxes, tracks)]
+
+    def _encode_largest(self, detector, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        dets = detector(gray)
+        if len(dets) == 0:
+            return None
+        d = max(dets, key=lambda r: r.width() * r.height())
+        box = (d.left(), d.top(), d.right(), d.bottom())
+        shape = self.sp(gray, d)
+        quality = self.enroll_quality.assess(gray, box, shape)
+        encoding = None
+        if quality['ok']:
+            encoding = np.array(self.facerec.compute_face_descriptor(frame, shape))
+        return {'encoding': encoding, 'quality': quality}
+
+    def enroll(self, frames, max_templates=ENROLL_MAX_TEMPLATES):
+        """Шаблоны лица для регистрации по серии кадров
+
+        На каждом кадре полным проходом детектора берется самое крупное лицо
+        и проверяется по строгим порогам (face_quality.ENROLL_THRESHOLDS). Прошедшие проверку дескрипторы
+        упорядочиваются по оценке качества; почти совпадающие с уже
+        выбранными (ближе ENROLL_DUPLICATE_DISTANCE) отбрасываются, остается
+        не больше max_templates. Возвращает словарь:
+          templates — [(encoding, score)], лучший первым,
+          frames — число кадров, no_face — кадров без лица,
+          rejected — {показатель: число кадров}, отсеянных по качеству,
+          duplicates — отброшенных почти одинаковых шаблонов.
+        """
+        # Детектор потока распознавания занят воркером — у регистрации свой
+        detector = get_detector()
+        result = {'templates': [], 'frames': 0, 'no_face': 0, 'rejected': {}, 'duplicates': 0}
+        candidates = []
+        for frame in frames:
+            result['frames'] += 1
+            face = self._encode_largest(detector, frame)
+            if face is None:
+                result['no_face'] += 1
+            elif face['encoding'] is None:
+                reason = face['quality']['reason']
+                result['rejected'][reason] = result['rejected'].get(reason, 0) + 1
+            else:
+                candidates.append(face)
+
+        candidates.sort(key=lambda face: face['quality']['score'], reverse=True)
+        chosen = []
+        for face in candidates:
+            if len(chosen) == max_templates:
+                break
+            if chosen and np.linalg.norm(np.array(chosen) - face['encoding'], axis=1).min() \
+                    < ENROLL_DUPLICATE_DISTANCE:
+                result['duplicates'] += 1
+                continue
+            chosen.append(face['encoding'])
+            result['templates'].append((face['encoding'], face['quality']['score']))
+        return result
+
+    def run(self, frames, continuous=True):
+        """Потоковое распознавание: генератор (frame, faces) по источнику кадров"""
+        self.reset()
+        for frame in frames:
+            if not continuous:
+                self.reset()
+            yield frame, self.process(frame)
+
+
+def draw_faces(frame, faces, scale=1.0):
+    """Рамки и подписи распознанных лиц поверх кадра (на месте)
+
+    scale — масштаб кадра относительно того, на котором найдены лица
+    (рамки рисуются по уже уменьшенному для показа кадру).
+    """
+    for box, match in faces:
+        left, top, right, bottom = (round(v * scale) for v in box)
+        if match:
+            _, student_id, name, _ = match
+            color = (0, 255, 0)  # Зеленый
+            label = f"{name} (ID: {student_id})"
+        else:
+            color = (0, 0, 255)  # Красный
+            label = "НЕИЗВЕСТЕН"
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 3)
+        cv2.putText(frame, label, (left, max(top - 10, 0)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+    return frame
+
+
+# ==================== КОНСОЛЬНЫЙ РЕЖИМ ====================
+
+def face_to_dict(box, match):
+    """Результат распознавания одного лица в виде словаря для JSON"""
+    face = {'box': list(box), 'recognized': match is not None}
+    if match:
+        user_id, student_id, name, distance = match
+        face.update({'user_id': user_id, 'student_id': student_id,
+                     'name': name, 'distance': round(distance, 4)})
+    return face
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Распознавание лиц без графического интерфейса (JSON Lines в stdout)")
+    parser.add_argument("--source", default="0",
+                        help="номер камеры, путь к видеофайлу или папке с изображениями")
+    parser.add_argument("--only-faces", action="store_true",
+                        help="выводить только кадры, на которых найдены лица")
+    parser.add_argument("--no-motion-gate", action="store_true",
+                        help="детекция на каждом кадре камеры (без режима ожидания)")
+    args = parser.parse_args(argv)
+
+    # Режим ожидания отсчитывает время по часам, поэтому включается только
+    # для камеры: в записанном видео он пропускал бы кадры в зависимости от
+    # скорости обработки, а пропущенный кадр неотличим от кадра без лиц
+    motion_gate = None
+    if str(args.source).isdigit() and not args.no_motion_gate:
+        motion_gate = MotionGate.for_camera(int(args.source))
+    engine = RecognitionEngine(motion_gate=motion_gate)
+    frames, continuous = open_source(args.source)
+    for index, (_, faces) in enumerate(engine.run(frames, continuous)):
+        if args.only_faces and not faces:
+            continue
+        print(json.dumps({'frame': index, 'faces': [face_to_dict(b, m) for b, m in faces]},
+                         ensure_ascii=False), flush=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
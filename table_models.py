@@ -0,0 +1,228 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QTimer
+from PyQt5.QtGui import QColor
+
+from database import USER_SORT_COLUMNS, get_last_log_id, query_logs, query_presence, query_users
+
+# Сколько строк подгружается из базы за один раз
+PAGE_SIZE = 200
+
+# Цветовая маркировка действий в журнале: (фон, текст)
+ACTION_COLORS = {
+    "Вход": (QColor(212, 237, 218), QColor(21, 87, 36)),     # Светло-зеленый
+    "Выход": (QColor(255, 243, 205), QColor(133, 100, 4)),   # Светло-желтый
+}
+
+
+class LazyTableModel(QAbstractTableModel):
+    """Таблица, подгружающая строки из базы страницами по мере прокрутки
+
+    Представление само вызывает canFetchMore/fetchMore, когда
+    пользователь докручивает до конца загруженных строк. Сортировка и
+    фильтры передаются в SQL: при их изменении загрузка начинается заново.
+
+    Наследники задают HEADERS, SORT_COLUMNS (номер столбца -> ключ
+    сортировки в запросе) и метод fetch_page(cursor, limit).
+    """
+
+    HEADERS = ()
+    SORT_COLUMNS = {}
+    DEFAULT_SORT_COLUMN = 0
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.cursor = None
+        self.has_more = True
+        self.filters = {}
+        self.sort_column = self.DEFAULT_SORT_COLUMN
+        self.sort_order = Qt.DescendingOrder
+        self.header = None
+
+    def attach(self, view):
+        """Подключить модель к QTableView с сортировкой по заголовку
+
+        Щелчок по столбцу без индекса не меняет сортировку — индикатор в
+        заголовке возвращается к фактической сортировке модели.
+        """
+        view.setModel(self)
+        self.header = view.horizontalHeader()
+        self.header.setSortIndicator(self.sort_column, self.sort_order)
+        view.setSortingEnabled(True)
+        self.header.sortIndicatorChanged.connect(self.on_sort_indicator_changed)
+        self.reload()
+
+    def on_sort_indicator_changed(self, column, order):
+        # Индикатор нельзя менять внутри обработки его же сигнала — откладываем
+        QTimer.singleShot(0, self.restore_sort_indicator)
+
+    def restore_sort_indicator(self):
+        current = (self.header.sortIndicatorSection(), self.header.sortIndicatorOrder())
+        if current != (self.sort_column, self.sort_order):
+            self.header.setSortIndicator(self.sort_column, self.sort_order)
+
+    # ---------- Загрузка ----------
+
+    def fetch_page(self, cursor, limit):
+        """Страница строк: словарь rows, has_more, cursor (см. database.keyset_page)"""
+        raise NotImplementedError
+
+    def reload(self):
+        """Сбросить загруженные строки и загрузить первую страницу заново"""
+        self.beginResetModel()
+        self.rows = []
+        self.cursor = None
+        self.has_more = True
+        self.endResetModel()
+        self.fetchMore(QModelIndex())
+
+    def set_filters(self, **filters):
+        """Задать фильтры запроса (пустые значения отбрасываются)"""
+        self.filters = {key: value for key, value in filters.items() if value}
+        self.reload()
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self.has_more
+
+    def fetchMore(self, parent):
+        if parent.isValid() or not self.has_more:
+            return
+        page = self.fetch_page(self.cursor, PAGE_SIZE)
+        self.cursor = page['cursor']
+        self.has_more = page['has_more']
+        if page['rows']:
+            first = len(self.rows)
+            self.beginInsertRows(QModelIndex(), first, first + len(page['rows']) - 1)
+            self.rows.extend(page['rows'])
+            self.endInsertRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        # Сортировка выполняется в SQL только по столбцам с индексом
+        if column not in self.SORT_COLUMNS:
+            return
+        if (column, order) == (self.sort_column, self.sort_order):
+            return
+        self.sort_column = column
+        self.sort_order = order
+        self.reload()
+
+    def sort_key(self):
+        return self.SORT_COLUMNS[self.sort_column]
+
+    def descending(self):
+        return self.sort_order == Qt.DescendingOrder
+
+    # ---------- Интерфейс QAbstractTableModel ----------
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.rows[index.row()][index.column()]
+        if role == Qt.DisplayRole:
+            return str(value)
+        return self.cell_style(index.column(), value, role)
+
+    def cell_style(self, column, value, role):
+        """Оформление ячейки для ролей кроме DisplayRole"""
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def flags(self, index):
+        # Ячейки только для чтения
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+
+class UsersTableModel(LazyTableModel):
+    """Пользователи: поиск (фильтр search) и сортировка по любому столбцу"""
+
+    HEADERS = ("ID", "ID Студента", "Имя", "Фамилия", "Факультет", "Дата регистрации")
+    SORT_COLUMNS = dict(enumerate(USER_SORT_COLUMNS))
+
+    def fetch_page(self, cursor, limit):
+        return query_users(self.filters.get('search'), self.sort_key(), self.descending(),
+                           cursor, limit)
+
+
+class AccessLogTableModel(LazyTableModel):
+    """Журнал доступа: фильтры query_logs и дозагрузка только новых событий"""
+
+    HEADERS = ("ID", "ID Студента", "ФИО", "Действие", "Локация", "Время")
+    # ФИО и действие не индексированы — по ним сортировка не выполняется
+    SORT_COLUMNS = {0: 'id', 1: 'student_id', 4: 'location', 5: 'timestamp'}
+    DEFAULT_SORT_COLUMN = 5
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.last_id = 0
+        self.loaded_ids = set()
+
+    def reload(self):
+        # Граница "новых" событий запоминается до чтения первой страницы;
+        # события, попавшие в нее после этого, отсекаются по loaded_ids
+        self.last_id = get_last_log_id()
+        self.loaded_ids = set()
+        super().reload()
+
+    def fetch_page(self, cursor, limit):
+        page = query_logs(order_by=self.sort_key(), descending=self.descending(),
+                          cursor=cursor, limit=limit, **self.filters)
+        self.loaded_ids.update(row[0] for row in page['rows'])
+        return page
+
+    def fetch_new(self):
+        """Добавить события, появившиеся после последней загрузки
+
+        При сортировке от новых к старым новые строки вставляются в начало
+        таблицы, уже показанные строки не перерисовываются. При другой
+        сортировке их место заранее неизвестно — таблица загружается заново.
+        Возвращает число новых событий.
+        """
+        new_rows = []
+        while True:
+            page = query_logs(after_id=self.last_id, limit=PAGE_SIZE, **self.filters)
+            new_rows.extend(row for row in page['rows'] if row[0] not in self.loaded_ids)
+            self.last_id = page['last_id']
+            if not page['has_more']:
+                break
+        if not new_rows:
+            return 0
+
+        if self.sort_key() in ('timestamp', 'id') and self.descending():
+            new_rows.reverse()
+            self.beginInsertRows(QModelIndex(), 0, len(new_rows) - 1)
+            self.rows[:0] = new_rows
+            self.loaded_ids.update(row[0] for row in new_rows)
+            self.endInsertRows()
+        else:
+            self.reload()
+        return len(new_rows)
+
+    def cell_style(self, column, value, role):
+        if column == 3 and value in ACTION_COLORS:  # Колонка "Действие"
+            background, foreground = ACTION_COLORS[value]
+            if role == Qt.BackgroundRole:
+                return background
+            if role == Qt.ForegroundRole:
+                return foreground
+        return None
+
+
+class PresenceTableModel(LazyTableModel):
+    """Находящиеся внутри (таблица presence): фильтр location"""
+
+    HEADERS = ("ID Студента", "ID", "ФИО", "Локация", "Время входа")
+    SORT_COLUMNS = {0: 'student_id', 3: 'location', 4: 'timestamp'}
+    DEFAULT_SORT_COLUMN = 4
+
+    def fetch_page(self, cursor, limit):
+        return query_presence(order_by=self.sort_key(), descending=self.descending(),
+                              cursor=cursor, limit=limit, **self.filters)
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Модули проекта при импорте создают базы в текущем каталоге — тесты
+# работают во временном, чтобы не трогать рабочие базы
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="face_recognition_tests_"))
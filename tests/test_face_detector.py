@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+dlib = pytest.importorskip("dlib")
+
+from face_detector import HOG_WINDOW_SIZE, FaceDetector
+
+FRAME_SIZE = (720, 1280)
+
+
+class WindowDetector:
+    """Имитация HOG dlib: находит только лица не меньше окна HOG на входном изображении"""
+
+    def __init__(self, faces):
+        self.faces = faces  # (left, top, size) в полном разрешении
+
+    def __call__(self, image, upsample=0):
+        factor = image.shape[1] / FRAME_SIZE[1]
+        rects = []
+        for left, top, size in self.faces:
+            if size * factor * 2 ** upsample >= HOG_WINDOW_SIZE:
+                rects.append(dlib.rectangle(int(left * factor), int(top * factor),
+                                            int((left + size) * factor), int((top + size) * factor)))
+        return rects
+
+
+@pytest.mark.parametrize("size", [80, 100, 120, 150])
+def test_kiosk_distance_faces_are_detected(size):
+    detector = FaceDetector(WindowDetector([(400, 200, size)]))
+    dets = detector.detect(np.zeros(FRAME_SIZE, dtype=np.uint8))
+    assert len(dets) == 1
+    assert abs(dets[0].width() - size) <= 2
+
+
+def test_min_face_size_sets_scale():
+    assert FaceDetector(None).scale == 1.0
+    assert FaceDetector(None, min_face_size=160).scale == 0.5
+    # Для лиц меньше окна HOG кадр увеличивается
+    assert FaceDetector(None, min_face_size=60).scale > 1.0
+    faces = WindowDetector([(400, 200, 60)])
+    assert len(FaceDetector(faces, min_face_size=60).detect(np.zeros(FRAME_SIZE, dtype=np.uint8))) == 1
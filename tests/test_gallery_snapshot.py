@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+
+import database
+from face_gallery import DESCRIPTOR_SIZE
+from gallery_snapshot import append_snapshot, load_snapshot_gallery, open_snapshot, sync_snapshot, write_snapshot
+
+# 129+ байт UTF-8, граница в середине кириллического символа при старой ширине S128
+LONG_NAME = "Александра-Виктория " * 4 + "Константинопольская-Преображенская"
+
+
+def _rows(user_ids, names, seed=0):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0.0, 0.09, size=(len(user_ids), DESCRIPTOR_SIZE)).astype(np.float32)
+    return encodings, [f"S{u}" for u in user_ids], user_ids, names
+
+
+def test_long_cyrillic_name_round_trip(tmp_path):
+    assert len(LONG_NAME.encode()) > 128
+    rows = _rows([1, 2], [LONG_NAME, "Иван Петров"])
+    write_snapshot(rows, seq=1, path=str(tmp_path))
+
+    gallery = open_snapshot(str(tmp_path))
+    assert gallery.names[0] == LONG_NAME
+    match = gallery.match(rows[0][0])[0]
+    assert match[:3] == (1, "S1", LONG_NAME)
+
+
+def test_append_keeps_text_columns_aligned(tmp_path):
+    write_snapshot(_rows([1], ["Анна"]), seq=1, path=str(tmp_path))
+    appended = _rows([2, 3], [LONG_NAME, "Пётр"], seed=1)
+    append_snapshot(appended, seq=2, path=str(tmp_path))
+
+    gallery = open_snapshot(str(tmp_path))
+    assert gallery.version == 2
+    assert list(gallery.names) == ["Анна", LONG_NAME, "Пётр"]
+    assert list(gallery.student_ids) == ["S1", "S2", "S3"]
+    assert gallery.match(appended[0][0])[0][2] == LONG_NAME
+
+
+def test_changes_after_open_copy_text_columns(tmp_path):
+    write_snapshot(_rows([1, 2], [LONG_NAME, "Анна"]), seq=1, path=str(tmp_path))
+    gallery = open_snapshot(str(tmp_path))
+    gallery.remove([2])
+    gallery.upsert(*_rows([3], ["Пётр"], seed=2))
+    assert list(gallery.names) == [LONG_NAME, "Пётр"]
+
+
+def test_rebuild_switches_version_atomically(tmp_path):
+    write_snapshot(_rows([1, 2], ["Анна", "Пётр"]), seq=1, path=str(tmp_path))
+    before = open_snapshot(str(tmp_path))
+    write_snapshot(_rows([3], ["Мария"], seed=1), seq=2, path=str(tmp_path))
+    append_snapshot(_rows([4], ["Олег"], seed=2), seq=3, path=str(tmp_path))
+
+    # Открытый раньше снимок продолжает читать свою версию целиком
+    assert list(before.names) == ["Анна", "Пётр"]
+    after = open_snapshot(str(tmp_path))
+    assert after.version == 3
+    assert list(after.names) == ["Мария", "Олег"]
+
+
+def test_old_versions_are_removed(tmp_path):
+    for seq in range(1, 6):
+        write_snapshot(_rows([seq], [f"Имя {seq}"], seed=seq), seq=seq, path=str(tmp_path))
+    versions = [p for p in tmp_path.iterdir() if p.is_dir()]
+    assert len(versions) <= 2
+    assert list(open_snapshot(str(tmp_path)).names) == ["Имя 5"]
+
+
+def _register(student_ids, seed=0):
+    rng = np.random.default_rng(seed)
+    for student_id in student_ids:
+        encoding = rng.normal(0.0, 0.09, size=DESCRIPTOR_SIZE)
+        assert database.save_face_templates(student_id, student_id, "Тест", "ФИТ", [(encoding, 1.0)])
+
+
+def _replace_users_db():
+    database.close_connection(database.DB_USERS)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(database.DB_USERS + suffix):
+            os.remove(database.DB_USERS + suffix)
+    database.init_db()
+
+
+def test_replaced_database_rebuilds_snapshot(tmp_path):
+    _replace_users_db()
+    _register(["OLD0", "OLD1", "OLD2"])
+    assert sync_snapshot(str(tmp_path)) == 'rebuilt'
+    assert sync_snapshot(str(tmp_path)) == 'fresh'
+
+    # Новая база: номер ленты начинается заново и меньше номера снимка
+    _replace_users_db()
+    _register(["NEW0"], seed=1)
+    gallery = load_snapshot_gallery(str(tmp_path))
+    assert list(gallery.student_ids) == ["NEW0"]
+
+    # Лента новой базы обогнала номер снимка и похожа на дозапись —
+    # отличает ее только идентификатор
+    _replace_users_db()
+    _register(["NEW1", "NEW2"], seed=2)
+    gallery = load_snapshot_gallery(str(tmp_path))
+    assert list(gallery.student_ids) == ["NEW1", "NEW2"]
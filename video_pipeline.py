@@ -0,0 +1,274 @@
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+
+from database import close_thread_connections
+
+
+class FpsMeter:
+    """Измерение частоты событий по скользящему окну"""
+
+    def __init__(self, window=30):
+        self.timestamps = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def tick(self):
+        with self.lock:
+            self.timestamps.append(time.perf_counter())
+
+    def fps(self):
+        with self.lock:
+            if len(self.timestamps) < 2:
+                return 0.0
+            elapsed = self.timestamps[-1] - self.timestamps[0]
+            return (len(self.timestamps) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+class CpuMeter:
+    """Загрузка процессора процессом (в процентах одного ядра) за последний интервал"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.percent = 0.0
+
+    def sample(self):
+        """Обновить значение, если прошел interval секунд; возвращает последнее"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        if wall - self.wall >= self.interval:
+            self.percent = (cpu - self.cpu) / (wall - self.wall) * 100.0
+            self.wall, self.cpu = wall, cpu
+        return self.percent
+
+
+class FrameRenderer:
+    """Отрисовка кадров BGR в виджете: сначала уменьшение, потом Qt
+
+    Кадр вписывается в размер виджета средствами OpenCV в заранее
+    выделенный буфер, поверх которого без копирования создается QImage
+    формата BGR888. Размер и буфер пересчитываются, только когда меняется
+    размер виджета или кадра. Буфер переиспользуется: изображение из fit()
+    действительно до следующего вызова.
+
+    Единственная копия — перевод QImage в формат экрана в QPixmap.fromImage;
+    поэтому готовый QPixmap не зависит от буфера. (QImage формата RGB32
+    Qt не копирует, и пиксмап ссылался бы на переиспользуемый буфер.)
+    """
+
+    def __init__(self):
+        self.key = None
+        self.buffer = None
+        self.reduced = None
+        self.scale = 1.0
+
+    def fit(self, frame, size):
+        """Кадр, вписанный в size (QSize) с сохранением пропорций: (изображение, масштаб)"""
+        h, w = frame.shape[:2]
+        key = (w, h, size.width(), size.height())
+        if key != self.key:
+            self.key = key
+            self.scale = min(size.width() / w, size.height() / h)
+            target = (max(1, round(h * self.scale)), max(1, round(w * self.scale)), 3)
+            self.buffer = np.empty(target, dtype=np.uint8)
+            # При сильном уменьшении билинейная интерполяция дает муар:
+            # сначала кадр уменьшается в целое число раз через INTER_AREA
+            # (для целого коэффициента у OpenCV быстрый путь)
+            factor = int(1 / self.scale)
+            self.reduced = (np.empty((h // factor, w // factor, 3), dtype=np.uint8)
+                            if factor >= 2 else None)
+        if self.reduced is not None:
+            cv2.resize(frame, (self.reduced.shape[1], self.reduced.shape[0]), dst=self.reduced,
+                       interpolation=cv2.INTER_AREA)
+            frame = self.reduced
+        cv2.resize(frame, (self.buffer.shape[1], self.buffer.shape[0]), dst=self.buffer,
+                   interpolation=cv2.INTER_LINEAR)
+        return self.buffer, self.scale
+
+    def pixmap(self, image):
+        """QPixmap из изображения BGR (QImage создается поверх его памяти)"""
+        h, w = image.shape[:2]
+        qimg = QImage(image.data, w, h, image.strides[0], QImage.Format_BGR888)
+        return QPixmap.fromImage(qimg)
+
+
+class EngineLoader(QThread):
+    """Фоновая загрузка движка распознавания (модели dlib и галерея)
+
+    factory вызывается в отдельном потоке; результат передается в GUI
+    сигналом loaded(engine) или failed(текст ошибки).
+    """
+
+    loaded = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, factory):
+        super().__init__()
+        self.factory = factory
+
+    def run(self):
+        try:
+            engine = self.factory()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.loaded.emit(engine)
+        finally:
+            # Галерея читалась из базы в этом потоке
+            close_thread_connections()
+
+
+class EnrollmentWorker(QThread):
+    """Выбор шаблонов лица из серии кадров регистрации в фоновом потоке
+
+    Полный проход детектора, landmarks и дескрипторы по всей серии
+    занимают секунды. Результат engine.enroll(frames) дополняется полем
+    match — ближайший уже зарегистрированный пользователь (или None) —
+    и передается в GUI сигналом enrolled(result) или failed(текст ошибки).
+    """
+
+    enrolled = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, engine, frames):
+        super().__init__()
+        self.engine = engine
+        self.frames = frames
+
+    def run(self):
+        try:
+            result = self.engine.enroll(self.frames)
+            matches = []
+            if result['templates']:
+                encodings = np.array([encoding for encoding, _ in result['templates']])
+                matches = [m for m in self.engine.gallery.match(encodings) if m]
+            result['match'] = min(matches, key=lambda m: m[3]) if matches else None
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.enrolled.emit(result)
+
+
+class CaptureThread(QThread):
+    """Поток захвата кадров с камеры
+
+    Хранит только последний кадр: если распознавание не успевает,
+    устаревшие кадры перезаписываются, а не копятся в очереди.
+    """
+
+    def __init__(self, camera_index=0):
+        super().__init__()
+        self.cap = cv2.VideoCapture(camera_index)
+        self.fps_meter = FpsMeter()
+        self.frame = None
+        self.seq = 0
+        self.taken_seq = 0
+        self.dropped = 0
+        self.condition = threading.Condition()
+        self._running = False
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def run(self):
+        self._running = True
+        while self._running and self.cap.isOpened():
+            ret, frame = self.cap.read()
+            if not ret:
+                self.msleep(5)
+                continue
+            self.fps_meter.tick()
+            with self.condition:
+                # Предыдущий кадр так никто и не забрал — он отбрасывается
+                if self.seq > self.taken_seq:
+                    self.dropped += 1
+                self.frame = frame
+                self.seq += 1
+                self.condition.notify_all()
+
+    def wait_for_frame(self, last_seq, timeout=0.1):
+        """Дождаться кадра новее last_seq и забрать его (seq, frame)"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > last_seq, timeout)
+            if self.seq <= last_seq:
+                return last_seq, None
+            self.taken_seq = self.seq
+            return self.seq, self.frame
+
+    def latest_frame(self):
+        """Последний захваченный кадр без ожидания (копия)"""
+        with self.condition:
+            return None if self.frame is None else self.frame.copy()
+
+    def stop(self):
+        self._running = False
+        self.wait()
+
+    def release(self):
+        self.stop()
+        if self.cap.isOpened():
+            self.cap.release()
+
+
+class InferenceWorker(QThread):
+    """Поток распознавания: прогоняет кадры камеры через RecognitionEngine
+
+    Результаты передаются в GUI сигналом results_ready. Пока GUI не
+    подтвердил отрисовку предыдущего результата (result_consumed),
+    новые результаты отбрасываются, а не встают в очередь событий Qt.
+    """
+
+    results_ready = pyqtSignal(object)
+
+    def __init__(self, capture, engine):
+        super().__init__()
+        self.capture = capture
+        self.engine = engine
+        self.fps_meter = FpsMeter()
+        self.cpu_meter = CpuMeter()
+        self._delivered = threading.Event()
+        self._delivered.set()
+        self._running = False
+
+    def run(self):
+        self._running = True
+        self._delivered.set()
+        last_seq = 0
+        while self._running:
+            last_seq, frame = self.capture.wait_for_frame(last_seq)
+            if frame is None:
+                continue
+
+            faces = self.engine.process(frame)
+            self.fps_meter.tick()
+            result = {
+                'frame': frame,
+                'faces': faces,
+                'capture_fps': self.capture.fps_meter.fps(),
+                'inference_fps': self.fps_meter.fps(),
+                'idle': self.engine.idle,
+                'cpu_percent': self.cpu_meter.sample(),
+            }
+            self._deliver(result)
+        # Синхронизация галереи открывала соединения с базой из этого потока
+        close_thread_connections()
+
+    def _deliver(self, result):
+        # GUI еще не отрисовал предыдущий результат — этот устарел
+        if not self._delivered.is_set():
+            return
+        self._delivered.clear()
+        self.results_ready.emit(result)
+
+    def result_consumed(self):
+        """Вызывается GUI после отрисовки результата"""
+        self._delivered.set()
+
+    def stop(self):
+        self._running = False
+        self.wait()